@@ -1,22 +1,42 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
+from contextlib import asynccontextmanager
 import logging
+import orjson
 import os
 import time
 
+# Carrega as variaveis de ambiente (uma unica vez, antes de importar as rotas)
+load_dotenv()
+
 # Importa os modulos de rotas
 from routes import chat, upload, history
 
-# Carrega as variaveis de ambiente
-load_dotenv()
+# Respostas JSON serializadas com orjson (bytes direto, sem passar pelo json da stdlib)
+class ORJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+# Abre o banco e migra o JSON antigo no startup do servidor, e nao no import das rotas
+# (os processos do pool de PDFs importam routes.upload e nao devem tocar no SQLite),
+# e descarta os chunks expirados; no shutdown, encerra o pool de processos
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    upload.migrate_user_files_data()
+    chat.purge_expired_text_chunks()
+    yield
+    upload.shutdown_pdf_process_pool()
 
 # Cria a aplicacao FastAPI
 app = FastAPI(
     title="AskFile API", 
     description="API para consultas inteligentes em PDFs - Processamento temporario de arquivos",
     version="2.0.0",
-    redirect_slashes=True # Adicionado para corrigir o erro 405
+    redirect_slashes=True, # Adicionado para corrigir o erro 405
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # Configuracao do CORS
@@ -25,7 +45,6 @@ app.add_middleware(
     allow_origins=[
         "http://localhost:3000",
         "https://askfile-seven.vercel.app",
-        "https://*.vercel.app",
         "https://askfile.onrender.com",
         "http://127.0.0.1:3000",
         "http://localhost:8000"
@@ -78,8 +97,8 @@ async def system_info():
         "description": "Sistema de consultas inteligentes em PDFs",
         "storage_policy": {
             "files": "Processamento temporario - arquivos removidos apos indexacao",
-            "embeddings": "Armazenamento em memoria para consultas",
-            "history": "Mantido em memoria durante a sessao"
+            "embeddings": "Chunks de texto em SQLite por 1 hora apos o upload, com cache em memoria para consultas",
+            "history": "Mantido em SQLite (ultimas 50 conversas por usuario)"
         },
         "supported_formats": ["PDF"],
         "max_file_size": "25MB",
@@ -98,7 +117,10 @@ async def system_info():
             "extracao_entidades_chave",
             "chunking_otimizado",
             "limpeza_texto_avancada"
-        ]
+        ],
+        "cache": {
+            "search_terms": chat.search_terms_cache_info()
+        }
     }
 
 # Rota para listar todas as rotas disponiveis (debug)
@@ -116,32 +138,48 @@ async def list_routes():
         "routes": routes
     }
 
-# Middleware para log de requisicoes
-@app.middleware("http")
-async def log_requests(request, call_next):
-    start_time = time.time()
-    
-    # Log da requisicao
-    logger.info(f"Requisicao: {request.method} {request.url.path}")
-    
-    response = await call_next(request)
-    process_time = time.time() - start_time
-    
-    # Log da resposta
-    logger.info(f"Resposta: {request.method} {request.url.path} - {response.status_code} - {process_time:.4f}s")
+# Middleware ASGI para log de requisicoes (sem a camada extra do BaseHTTPMiddleware)
+class TimingMiddleware:
+    def __init__(self, app, skip_paths: set = frozenset()):
+        self.app = app
+        self.skip_paths = skip_paths
     
-    return response
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+        
+        start_time = time.perf_counter_ns()
+        
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                process_time = (time.perf_counter_ns() - start_time) / 1_000_000_000
+                # Log unico por requisicao
+                logger.info(f"Requisicao: {scope['method']} {scope['path']} - {message['status']} - {process_time:.4f}s")
+            await send(message)
+        
+        await self.app(scope, receive, send_with_timing)
 
-# Handler para opcoes CORS
-@app.options("/{path:path}")
-async def options_handler(path: str):
-    return {"message": "OK"}
+# Health checks e rotas de debug ficam fora do log
+app.add_middleware(TimingMiddleware, skip_paths={"/", "/api/routes", "/api/info", "/favicon.ico"})
 
 # Execucao local
 if __name__ == "__main__":
     import uvicorn
     logger.info("=== Iniciando AskFile API v2.0 ===")
     logger.info("Modo: Processamento temporario sem autenticacao")
-    logger.info("Recursos: Upload PDF + Chat IA + Historico em memoria")
+    logger.info("Recursos: Upload PDF + Chat IA + Historico em SQLite")
     logger.info("Melhorias: Deteccao contexto + Busca inteligente")
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
\ No newline at end of file
+    # uvloop/httptools quando instalados (indisponiveis no Windows)
+    # Chunks, historico e dados dos arquivos ficam no SQLite local, compartilhado pelos workers;
+    # apenas os caches (text_storage, respostas, termos) sao de cada processo
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        log_level="info",
+        loop="auto",
+        http="auto",
+        workers=int(os.getenv("WEB_CONCURRENCY", 1)),
+        access_log=False  # TimingMiddleware ja registra as requisicoes
+    )
\ No newline at end of file
@@ -1,45 +1,148 @@
 from fastapi import APIRouter, Body, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from groq import Groq
-from dotenv import load_dotenv
+from typing import Optional
+from functools import lru_cache
+import asyncio
+import hashlib
+import orjson
+import heapq
 import os
 import logging
 import re
-from datetime import datetime
+import sys
+import time
+from datetime import datetime, timedelta
 import difflib
+import ahocorasick
+from cachetools import LRUCache, TTLCache
+from rapidfuzz import fuzz, process
 
-load_dotenv()
-
-groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+@lru_cache(maxsize=1)
+def get_groq_client():
+    """Cria o cliente Groq assincrono na primeira chamada, com conexoes persistentes (keep-alive)"""
+    try:
+        import httpx
+        from groq import AsyncGroq
+        
+        http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=5.0),
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=40)
+        )
+        return AsyncGroq(api_key=os.getenv("GROQ_API_KEY"), http_client=http_client)
+    except Exception as e:
+        logger.error(f"Erro ao criar cliente Groq: {e}")
+        return None
+
 DEFAULT_USER_EMAIL = "usuario@askfile.com"
 
-text_storage = {}
-history_storage = {}
+# Expressoes regulares compiladas uma unica vez
+WORD_RE = re.compile(r'\w+')
+NUMBER_RE = re.compile(r'\b\d+(?:[.,]\d+)?\b')
+NOTA_RE = re.compile(r'(?:nota|média|pontos?)[:\s]*([0-9]+[,.]?[0-9]*)', re.IGNORECASE)
+SITUACAO_RE = re.compile(r'(aprovado|reprovado|cancelado|trancado|dispensado)', re.IGNORECASE)
+DISCIPLINA_RE = re.compile(r'(?:disciplina|matéria|componente)[^0-9\n]*?([A-ZÁÀÁÂÃÉÊÍÓÔÕÚÇ][^0-9\n]{10,50})', re.IGNORECASE)
+PERIODO_RE = re.compile(r'(\d{4}\.\d{1,2})')
+VALOR_RE = re.compile(r'R?\$?\s*([0-9]{1,3}(?:[.,][0-9]{3})*(?:[.,][0-9]{2})?)')
+DATA_RE = re.compile(r'(\d{1,2}[/\-]\d{1,2}[/\-]\d{2,4})')
+
+# Chunks e historico ficam no SQLite (compartilhado entre workers);
+# text_storage e apenas o cache local de cada processo, limitado pela memoria ocupada (sys.getsizeof)
+MAX_TEXT_STORAGE_BYTES = 200 * 1024 * 1024
+MAX_HISTORY_ITEMS = 50
+# Processamento temporario: os chunks de um arquivo expiram uma hora apos o upload
+TEXT_CHUNKS_TTL = 3600
+
+class EvictionLoggingLRUCache(LRUCache):
+    """LRUCache que registra as remocoes feitas para respeitar o limite"""
+    
+    def __init__(self, name: str, maxsize: int, getsizeof=None, on_evict=None):
+        super().__init__(maxsize=maxsize, getsizeof=getsizeof)
+        self.name = name
+        self.on_evict = on_evict
+    
+    def popitem(self):
+        key, value = super().popitem()
+        logger.info(f"{self.name}: '{key}' removido por limite de memoria")
+        if self.on_evict:
+            self.on_evict(key)
+        return key, value
+
+def estimate_file_data_size(chunks: list, chunks_lower: list, chunks_words: list, distinct_words: dict, vocabulary: list, word_chunks: dict) -> int:
+    """Memoria aproximada (em bytes, com o overhead de cada objeto) dos dados de busca de um arquivo"""
+    return (
+        sys.getsizeof(chunks) + sum(map(sys.getsizeof, chunks))
+        + sys.getsizeof(chunks_lower) + sum(map(sys.getsizeof, chunks_lower))
+        + sys.getsizeof(chunks_words) + sum(map(sys.getsizeof, chunks_words))
+        + sys.getsizeof(distinct_words) + sum(map(sys.getsizeof, distinct_words))
+        + sys.getsizeof(vocabulary) + sys.getsizeof(word_chunks) + sum(map(sys.getsizeof, word_chunks.values()))
+    )
+
+text_storage = EvictionLoggingLRUCache(
+    "text_storage",
+    maxsize=MAX_TEXT_STORAGE_BYTES,
+    getsizeof=lambda file_data: file_data['memory_size'],
+    on_evict=lambda storage_key: clear_cached_answers(storage_key)
+)
+
+# Cache LRU dos termos gerados pela IA, chaveado pela pergunta normalizada
+SEARCH_TERMS_CACHE_SIZE = 2048
+search_terms_cache = LRUCache(maxsize=SEARCH_TERMS_CACHE_SIZE)
+search_terms_cache_stats = {'hits': 0, 'misses': 0, 'local': 0}
+
+# Perguntas com ate esse numero de palavras usam expansao local, sem chamar a IA
+SHORT_QUERY_MAX_WORDS = 3
+
+# Cache de respostas por arquivo + pergunta normalizada; perguntas apenas parecidas (outra
+# disciplina, uma negacao) pedem outra resposta, entao so a pergunta igual reaproveita
+EXACT_ANSWER_CACHE_SIZE = 10000
+EXACT_ANSWER_CACHE_TTL = 1800
+exact_answer_cache = TTLCache(maxsize=EXACT_ANSWER_CACHE_SIZE, ttl=EXACT_ANSWER_CACHE_TTL)
 
 class ChatRequest(BaseModel):
     question: str
     file_id: str = None
     user_email: str = DEFAULT_USER_EMAIL
 
+DOCUMENT_CONTEXTS = {
+    'academico': ['nota', 'disciplina', 'aprovado', 'reprovado', 'media', 'credito', 'historico', 'curso', 'semestre'],
+    'financeiro': ['valor', 'pagamento', 'debito', 'credito', 'saldo', 'fatura', 'boleto', 'conta'],
+    'juridico': ['processo', 'tribunal', 'acao', 'sentenca', 'advogado', 'lei', 'artigo'],
+    'medico': ['paciente', 'exame', 'medicamento', 'sintoma', 'diagnostico', 'tratamento'],
+    'tecnico': ['sistema', 'configuracao', 'instalacao', 'manutencao', 'especificacao']
+}
+
+def build_context_automaton():
+    """Automato com as palavras-chave de todos os contextos (uma palavra pode pontuar varios)"""
+    keyword_contexts = {}
+    for context, keywords in DOCUMENT_CONTEXTS.items():
+        for keyword in keywords:
+            keyword_contexts.setdefault(keyword, []).append(context)
+    
+    automaton = ahocorasick.Automaton()
+    for keyword, contexts in keyword_contexts.items():
+        automaton.add_word(keyword, (keyword, len(keyword), tuple(contexts)))
+    automaton.make_automaton()
+    return automaton
+
+CONTEXT_AUTOMATON = build_context_automaton()
+
 def detect_document_context(text: str) -> str:
     """Detecta o contexto do documento baseado em padrões"""
-    contexts = {
-        'academico': ['nota', 'disciplina', 'aprovado', 'reprovado', 'media', 'credito', 'historico', 'curso', 'semestre'],
-        'financeiro': ['valor', 'pagamento', 'debito', 'credito', 'saldo', 'fatura', 'boleto', 'conta'],
-        'juridico': ['processo', 'tribunal', 'acao', 'sentenca', 'advogado', 'lei', 'artigo'],
-        'medico': ['paciente', 'exame', 'medicamento', 'sintoma', 'diagnostico', 'tratamento'],
-        'tecnico': ['sistema', 'configuracao', 'instalacao', 'manutencao', 'especificacao']
-    }
-    
     text_lower = text.lower()
-    scores = {}
+    scores = dict.fromkeys(DOCUMENT_CONTEXTS, 0)
     
-    for context, keywords in contexts.items():
-        score = sum(text_lower.count(keyword) for keyword in keywords)
-        scores[context] = score
+    # Uma unica passada pelo texto para todas as palavras-chave (sem sobreposicao, como str.count)
+    next_allowed = {}
+    for end_pos, (keyword, keyword_len, contexts) in CONTEXT_AUTOMATON.iter(text_lower):
+        start_pos = end_pos - keyword_len + 1
+        if start_pos >= next_allowed.get(keyword, 0):
+            next_allowed[keyword] = start_pos + keyword_len
+            for context in contexts:
+                scores[context] += 1
     
     return max(scores, key=scores.get) if max(scores.values()) > 0 else 'geral'
 
@@ -49,34 +152,72 @@ def extract_key_entities(text: str, context: str) -> dict:
     
     if context == 'academico':
         # Notas e medias
-        notas = re.findall(r'(?:nota|média|pontos?)[:\s]*([0-9]+[,.]?[0-9]*)', text, re.IGNORECASE)
+        notas = NOTA_RE.findall(text)
         entities['notas'] = notas
         
         # Situacoes academicas
-        situacoes = re.findall(r'(aprovado|reprovado|cancelado|trancado|dispensado)', text, re.IGNORECASE)
+        situacoes = SITUACAO_RE.findall(text)
         entities['situacoes'] = situacoes
         
         # Disciplinas
-        disciplinas = re.findall(r'(?:disciplina|matéria|componente)[^0-9\n]*?([A-ZÁÀÁÂÃÉÊÍÓÔÕÚÇ][^0-9\n]{10,50})', text, re.IGNORECASE)
+        disciplinas = DISCIPLINA_RE.findall(text)
         entities['disciplinas'] = disciplinas
         
         # Periodos
-        periodos = re.findall(r'(\d{4}\.\d{1,2})', text)
+        periodos = PERIODO_RE.findall(text)
         entities['periodos'] = periodos
     
     elif context == 'financeiro':
         # Valores monetarios
-        valores = re.findall(r'R?\$?\s*([0-9]{1,3}(?:[.,][0-9]{3})*(?:[.,][0-9]{2})?)', text)
+        valores = VALOR_RE.findall(text)
         entities['valores'] = valores
         
         # Datas
-        datas = re.findall(r'(\d{1,2}[/\-]\d{1,2}[/\-]\d{2,4})', text)
+        datas = DATA_RE.findall(text)
         entities['datas'] = datas
     
     return entities
 
-def generate_enhanced_search_terms(query: str, context: str, entities: dict) -> list:
+def search_terms_cache_key(query: str, context: str, entities: dict) -> bytes:
+    """Chave do cache: hash da pergunta normalizada + contexto + entidades"""
+    normalized_query = ' '.join(query.strip().lower().split())
+    entities_key = sorted((name, tuple(values)) for name, values in entities.items())
+    return hashlib.sha256(f"{normalized_query}|{context}|{entities_key}".encode('utf-8')).digest()[:16]
+
+def search_terms_cache_info() -> dict:
+    """Estatisticas do cache de termos de busca"""
+    total = search_terms_cache_stats['hits'] + search_terms_cache_stats['misses']
+    return {
+        **search_terms_cache_stats,
+        'size': len(search_terms_cache),
+        'max_size': SEARCH_TERMS_CACHE_SIZE,
+        'hit_rate': round(search_terms_cache_stats['hits'] / total, 3) if total else 0.0
+    }
+
+def local_search_terms(query: str) -> list:
+    """Termos de busca sem IA: a pergunta completa seguida das palavras com mais de 2 letras"""
+    query_lower = query.lower()
+    terms = [query_lower] + [word for word in query_lower.split() if len(word) > 2]
+    unique_terms = []
+    for term in terms:
+        if term not in unique_terms and len(term) >= 2:
+            unique_terms.append(term)
+    return unique_terms[:15]
+
+async def generate_enhanced_search_terms(query: str, context: str, entities: dict) -> list:
     """Gera termos de busca melhorados baseados no contexto"""
+    # Perguntas curtas ja sao praticamente palavras-chave: evita uma ida a IA
+    if len(query.split()) <= SHORT_QUERY_MAX_WORDS:
+        search_terms_cache_stats['local'] += 1
+        return local_search_terms(query)
+    
+    cache_key = search_terms_cache_key(query, context, entities)
+    cached_terms = search_terms_cache.get(cache_key)
+    if cached_terms is not None:
+        search_terms_cache_stats['hits'] += 1
+        return list(cached_terms)
+    search_terms_cache_stats['misses'] += 1
+    
     try:
         base_prompt = f"""
         Pergunta: "{query}"
@@ -92,7 +233,7 @@ def generate_enhanced_search_terms(query: str, context: str, entities: dict) ->
         Retorne apenas os termos separados por vírgula:
         """
         
-        response = groq_client.chat.completions.create(
+        response = await get_groq_client().chat.completions.create(
             model="llama3-8b-8192",
             messages=[{"role": "user", "content": base_prompt}],
             max_tokens=200,
@@ -113,6 +254,9 @@ def generate_enhanced_search_terms(query: str, context: str, entities: dict) ->
                 seen.add(term)
                 unique_terms.append(term)
         
+        # Apenas respostas bem-sucedidas entram no cache
+        search_terms_cache[cache_key] = unique_terms[:15]
+        
         return unique_terms[:15]
         
     except Exception as e:
@@ -123,141 +267,261 @@ def calculate_similarity_score(query_word: str, chunk_word: str) -> float:
     """Calcula similaridade entre palavras usando sequencematcher"""
     return difflib.SequenceMatcher(None, query_word.lower(), chunk_word.lower()).ratio()
 
-def smart_text_search(query: str, file_id: str, user_email: str, max_results: int = 8) -> tuple:
+def build_terms_automaton(search_terms: list):
+    """Monta automato Aho-Corasick com todos os termos de busca"""
+    automaton = ahocorasick.Automaton()
+    for term_idx, term in enumerate(search_terms):
+        automaton.add_word(term, (term_idx, len(term)))
+    automaton.make_automaton()
+    return automaton
+
+def find_term_occurrences(automaton, text: str) -> dict:
+    """Em uma unica passada, lista as posicoes de cada termo (sem sobreposicao, como str.count)"""
+    positions = {}
+    if len(automaton) == 0:
+        return positions
+    
+    next_allowed = {}
+    for end_pos, (term_idx, term_len) in automaton.iter(text):
+        start_pos = end_pos - term_len + 1
+        if start_pos >= next_allowed.get(term_idx, 0):
+            positions.setdefault(term_idx, []).append(start_pos)
+            next_allowed[term_idx] = start_pos + term_len
+    
+    return positions
+
+def min_distance(positions_a: list, positions_b: list) -> int:
+    """Menor distancia entre duas listas ordenadas de posicoes (percorre as duas uma vez)"""
+    i = j = 0
+    best = abs(positions_a[0] - positions_b[0])
+    while i < len(positions_a) and j < len(positions_b):
+        distance = positions_a[i] - positions_b[j]
+        if abs(distance) < best:
+            best = abs(distance)
+        if distance < 0:
+            i += 1
+        else:
+            j += 1
+    return best
+
+def find_similar_words(query: str, file_data: dict) -> list:
+    """Para cada chunk, lista as palavras parecidas com as da pergunta (nao depende dos termos gerados)"""
+    query_words = [q_word for q_word in WORD_RE.findall(query.lower()) if len(q_word) > 3]
+    chunks_words = file_data['chunks_words']
+    if not query_words:
+        return [[] for _ in chunks_words]
+    vocabulary = file_data['vocabulary']
+    
+    # Compara cada palavra da pergunta com o vocabulario do documento (uma vez por palavra distinta).
+    # O rapidfuzz (em C) serve de pre-filtro: sua razao usa a maior subsequencia comum e nunca fica
+    # abaixo da razao do difflib, entao nenhum par acima de 0.85 e descartado antes da confirmacao
+    word_matches = {}
+    candidate_chunks = set()
+    for q_word in set(query_words):
+        known_matches = {}
+        for c_word, _, _ in process.extract(q_word, vocabulary, scorer=fuzz.ratio, score_cutoff=85, limit=None):
+            similarity = calculate_similarity_score(q_word, c_word)
+            if similarity > 0.85:
+                known_matches[c_word] = (similarity, f"{q_word}~{c_word}")
+                candidate_chunks.update(file_data['word_chunks'][c_word])
+        word_matches[q_word] = known_matches
+    
+    # Apenas chunks que contem alguma palavra parecida sao percorridos, na ordem original das palavras
+    similar_words = []
+    for i, chunk_words in enumerate(chunks_words):
+        matches = []
+        if i in candidate_chunks:
+            for q_word in query_words:
+                known_matches = word_matches[q_word]
+                for c_word in chunk_words:
+                    match = known_matches.get(c_word)
+                    if match:
+                        matches.append(match)
+        similar_words.append(matches)
+    
+    return similar_words
+
+def rank_chunks(query: str, file_id: str, file_data: dict, doc_context: str, search_terms: list, similar_words: list, max_results: int) -> tuple:
+    """Pontua os chunks com os termos gerados e retorna os melhores (CPU, executado fora do event loop)"""
+    chunks = file_data['chunks']
+    chunks_lower = file_data['chunks_lower']
+    
+    # Scores e termos em listas paralelas; dicts so para os melhores resultados
+    chunk_scores = [0] * len(chunks)
+    chunk_matched_terms = [None] * len(chunks)
+    automaton = build_terms_automaton(search_terms)
+    
+    # Tudo que depende apenas da pergunta e calculado uma vez, fora do loop de chunks
+    query_lower = query.lower()
+    term_weights = [4.0 if term_idx == 0 else max(2.5 - (term_idx * 0.1), 0.8) for term_idx in range(len(search_terms))]
+    proximity_terms = range(min(3, len(search_terms) - 1))
+    number_variants = [
+        (num, {num, num.replace(',', '.'), num.replace('.', ',')})
+        for num in NUMBER_RE.findall(query)
+    ]
+    query_context_keywords = []
+    if doc_context == 'academico':
+        academic_keywords = ['aprovado', 'reprovado', 'nota', 'média', 'disciplina', 'matéria']
+        query_context_keywords = [keyword for keyword in academic_keywords if keyword in query_lower]
+    
+    for i, chunk in enumerate(chunks):
+        chunk_lower = chunks_lower[i]
+        score = 0
+        matched_terms = []
+        term_positions = find_term_occurrences(automaton, chunk_lower)
+        
+        # Busca exata por termos
+        for term_idx in sorted(term_positions):
+            score += len(term_positions[term_idx]) * term_weights[term_idx]
+            matched_terms.append(search_terms[term_idx])
+        
+        # Busca por similaridade de palavras
+        for similarity, similar_term in similar_words[i]:
+            score += similarity * 2.0
+            matched_terms.append(similar_term)
+        
+        # Proximidade entre termos importantes (menor distancia entre quaisquer ocorrencias)
+        for i_term in proximity_terms:
+            if i_term in term_positions and i_term + 1 in term_positions:
+                distance = min_distance(term_positions[i_term], term_positions[i_term + 1])
+                if distance < 80:
+                    proximity_bonus = 2.0 * (80 - distance) / 80
+                    score += proximity_bonus
+                    matched_terms.append("proximidade")
+        
+        # Bonus para multiplos termos
+        unique_found = len(term_positions)
+        if unique_found > 1:
+            score += unique_found * 1.5
+            matched_terms.append(f"multi_termos_{unique_found}")
+        
+        # Busca por numeros na query
+        for num, variants in number_variants:
+            if any(variant in chunk for variant in variants):
+                score += 3.5
+                matched_terms.append(f"numero_{num}")
+        
+        # Bonus para contexto especifico
+        for keyword in query_context_keywords:
+            if keyword in chunk_lower:
+                score += 2.0
+                matched_terms.append(f"contexto_{keyword}")
+        
+        chunk_scores[i] = score
+        chunk_matched_terms[i] = matched_terms
+    
+    # Seleciona os melhores sem ordenar todos os chunks (mesma ordem de sorted(..., reverse=True))
+    candidates = [i for i, score in enumerate(chunk_scores) if score > 0]
+    best_indexes = heapq.nlargest(max_results, candidates, key=chunk_scores.__getitem__)
+    
+    context_parts = []
+    sources = []
+    for i in best_indexes:
+        chunk = chunks[i]
+        context_parts.append(chunk)
+        sources.append({
+            'content': chunk[:180] + "..." if len(chunk) > 180 else chunk,
+            'score': round(chunk_scores[i], 2),
+            'file_id': file_id,
+            'matched_terms': chunk_matched_terms[i][:8],
+            'context': doc_context
+        })
+    
+    logger.info(f"Busca melhorada retornou {len(context_parts)} resultados para: '{query}'")
+    if best_indexes:
+        logger.info(f"Melhor score: {chunk_scores[best_indexes[0]]:.2f}")
+    
+    return context_parts, sources
+
+async def smart_text_search(query: str, file_id: str, file_data: Optional[dict], max_results: int = 8) -> tuple:
     """Busca inteligente melhorada"""
     try:
-        storage_key = f"{user_email}_{file_id}"
-        if storage_key not in text_storage:
+        if not file_data:
             return [], []
         
-        file_data = text_storage[storage_key]
         chunks = file_data.get('chunks', [])
         
         if not chunks:
             return [], []
         
-        # Analisa contexto do documento
-        full_text = ' '.join(chunks[:3])
-        doc_context = detect_document_context(full_text)
-        entities = extract_key_entities(full_text, doc_context)
+        # Contexto do documento, calculado quando os chunks foram salvos
+        doc_context = file_data['doc_context']
+        entities = file_data['entities']
         
         logger.info(f"Contexto detectado: {doc_context}")
         
-        # Gera termos de busca melhorados
-        search_terms = generate_enhanced_search_terms(query, doc_context, entities)
-        
-        scored_chunks = []
-        
-        for i, chunk in enumerate(chunks):
-            chunk_lower = chunk.lower()
-            score = 0
-            matched_terms = []
-            
-            # Busca exata por termos
-            for term_idx, term in enumerate(search_terms):
-                exact_matches = chunk_lower.count(term)
-                if exact_matches > 0:
-                    weight = 4.0 if term_idx == 0 else max(2.5 - (term_idx * 0.1), 0.8)
-                    score += exact_matches * weight
-                    matched_terms.append(term)
-            
-            # Busca por similaridade de palavras
-            query_words = re.findall(r'\w+', query.lower())
-            chunk_words = re.findall(r'\w+', chunk_lower)
-            
-            for q_word in query_words:
-                if len(q_word) > 3:
-                    for c_word in chunk_words:
-                        if len(c_word) > 3:
-                            similarity = calculate_similarity_score(q_word, c_word)
-                            if similarity > 0.85:
-                                score += similarity * 2.0
-                                matched_terms.append(f"{q_word}~{c_word}")
-            
-            # Proximidade entre termos importantes
-            for i_term in range(min(3, len(search_terms) - 1)):
-                term1, term2 = search_terms[i_term], search_terms[i_term + 1]
-                if term1 in chunk_lower and term2 in chunk_lower:
-                    pos1 = chunk_lower.find(term1)
-                    pos2 = chunk_lower.find(term2)
-                    distance = abs(pos1 - pos2)
-                    if distance < 80:
-                        proximity_bonus = 2.0 * (80 - distance) / 80
-                        score += proximity_bonus
-                        matched_terms.append("proximidade")
-            
-            # Bonus para multiplos termos
-            unique_found = len(set(term for term in search_terms if term in chunk_lower))
-            if unique_found > 1:
-                score += unique_found * 1.5
-                matched_terms.append(f"multi_termos_{unique_found}")
-            
-            # Busca por numeros na query
-            numbers_in_query = re.findall(r'\b\d+(?:[.,]\d+)?\b', query)
-            for num in numbers_in_query:
-                if num in chunk or num.replace(',', '.') in chunk or num.replace('.', ',') in chunk:
-                    score += 3.5
-                    matched_terms.append(f"numero_{num}")
-            
-            # Bonus para contexto especifico
-            if doc_context == 'academico':
-                academic_keywords = ['aprovado', 'reprovado', 'nota', 'média', 'disciplina', 'matéria']
-                for keyword in academic_keywords:
-                    if keyword in query.lower() and keyword in chunk_lower:
-                        score += 2.0
-                        matched_terms.append(f"contexto_{keyword}")
-            
-            if score > 0:
-                scored_chunks.append({
-                    'content': chunk,
-                    'score': score,
-                    'index': i,
-                    'matched_terms': matched_terms[:8],
-                    'context': doc_context
-                })
-        
-        # Ordena por score
-        scored_chunks.sort(key=lambda x: x['score'], reverse=True)
-        best_chunks = scored_chunks[:max_results]
-        
-        context_parts = [chunk['content'] for chunk in best_chunks]
-        sources = [{
-            'content': chunk['content'][:180] + "..." if len(chunk['content']) > 180 else chunk['content'],
-            'score': round(chunk['score'], 2),
-            'file_id': file_id,
-            'matched_terms': chunk['matched_terms'],
-            'context': chunk['context']
-        } for chunk in best_chunks]
-        
-        logger.info(f"Busca melhorada retornou {len(context_parts)} resultados para: '{query}'")
-        if best_chunks:
-            logger.info(f"Melhor score: {best_chunks[0]['score']:.2f}")
+        # Gera termos de busca melhorados enquanto a similaridade de palavras e calculada em outra thread
+        search_terms, similar_words = await asyncio.gather(
+            generate_enhanced_search_terms(query, doc_context, entities),
+            asyncio.to_thread(find_similar_words, query, file_data)
+        )
         
-        return context_parts, sources
+        # Pontuacao dos chunks (CPU) em outra thread, liberando o event loop
+        return await asyncio.to_thread(
+            rank_chunks, query, file_id, file_data, doc_context, search_terms, similar_words, max_results
+        )
         
     except Exception as e:
         logger.error(f"Erro na busca melhorada: {e}")
         return [], []
 
+def exact_answer_key(storage_key: str, question: str) -> tuple:
+    """Chave do cache exato: arquivo + pergunta normalizada"""
+    return storage_key, ' '.join(question.strip().lower().split())
+
+def cache_answer(storage_key: str, question: str, answer: str, sources: list, context: str, chunks_found: int):
+    """Guarda a resposta gerada pela IA para reaproveitamento"""
+    entry = {
+        'answer': answer,
+        'sources': sources,
+        'context': context[:400] + "..." if len(context) > 400 else context,
+        'context_length': len(context),
+        'chunks_found': chunks_found
+    }
+    exact_answer_cache[exact_answer_key(storage_key, question)] = entry
+
+def clear_cached_answers(storage_key: str):
+    """Remove as respostas guardadas de um arquivo"""
+    for key in [key for key in exact_answer_cache if key[0] == storage_key]:
+        exact_answer_cache.pop(key, None)
+
+@lru_cache(maxsize=2)
+def format_timestamp(second: int) -> str:
+    """Formata o instante (em segundos) uma unica vez"""
+    return datetime.fromtimestamp(second).isoformat()
+
+def current_timestamp() -> str:
+    """Timestamp atual com resolucao de segundos; requisicoes no mesmo segundo reutilizam o texto"""
+    return format_timestamp(int(time.time()))
+
 def save_to_history(user_email: str, question: str, answer: str, sources: list, file_id: str = None):
     """Salva no historico"""
+    from routes.upload import db_lock, get_db_connection
+    
     try:
-        if user_email not in history_storage:
-            history_storage[user_email] = []
-        
+        timestamp = current_timestamp()
         history_item = {
             "question": question,
             "answer": answer,
             "sources": sources,
             "file_id": file_id,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": timestamp,
+            "date": timestamp[:10]
         }
         
-        history_storage[user_email].append(history_item)
-        
-        # Limita historico
-        if len(history_storage[user_email]) > 50:
-            history_storage[user_email] = history_storage[user_email][-50:]
+        with db_lock:
+            connection = get_db_connection()
+            connection.execute(
+                "INSERT INTO chat_history (user_email, item) VALUES (?, ?)",
+                (user_email, orjson.dumps(history_item).decode())
+            )
+            # Limita historico: remove tudo ate o primeiro item alem do limite (busca pelo indice)
+            connection.execute(
+                "DELETE FROM chat_history WHERE user_email = ? AND id <= "
+                "(SELECT id FROM chat_history WHERE user_email = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (user_email, user_email, MAX_HISTORY_ITEMS)
+            )
+            connection.commit()
         
         logger.info(f"Item salvo no historico para {user_email}")
         return True
@@ -266,41 +530,105 @@ def save_to_history(user_email: str, question: str, answer: str, sources: list,
         logger.error(f"Erro ao salvar historico: {e}")
         return False
 
-@router.post("")
-async def send_message(request: ChatRequest = Body(...)):
-    """Endpoint principal para chat"""
-    try:
-        question = request.question
-        file_id = request.file_id
-        user_email = request.user_email or DEFAULT_USER_EMAIL
-        
-        if not question:
-            raise HTTPException(status_code=400, detail='Pergunta obrigatoria')
+NO_CONTEXT_ANSWER = "Nao encontrei informacoes relevantes no arquivo para responder essa pergunta.\n\nDicas para melhor resultado:\n\n1. Use palavras-chave especificas do documento\n2. Tente reformular a pergunta de forma mais direta\n3. Verifique se o conteudo esta relacionado ao arquivo enviado"
+ANSWER_ERROR_MESSAGE = "Erro ao processar sua pergunta. Tente novamente."
+# Limite do contexto enviado a IA (~4k tokens, deixando espaco para instrucoes e resposta na janela de 8k)
+MAX_CONTEXT_CHARS = 16000
+CONTEXT_SEPARATOR = "\n\n---\n\n"
 
-        if not file_id:
-            raise HTTPException(status_code=400, detail='ID do arquivo obrigatorio')
+# Parte fixa do prompt em uma mensagem de sistema: igual em todas as chamadas (prefixo reaproveitavel)
+ANSWER_SYSTEM_PROMPT = """Voce e um assistente especializado em analisar documentos e responder perguntas com base no conteudo fornecido.
 
-        logger.info(f"Pergunta recebida: {question} (usuario: {user_email})")
+INSTRUCOES:
+- Responda APENAS com base no contexto fornecido
+- Se a informacao nao estiver no contexto, diga que nao encontrou no documento
+- Seja preciso e cite partes especificas quando relevante
+- Use linguagem clara e organize a resposta de forma estruturada
+- Se houver dados, numeros ou fatos especificos, mencione-os
+- Para perguntas sobre notas ou situacoes academicas, seja muito preciso nos valores e status
+- Quando houver multiplas ocorrencias de algo, liste todas claramente"""
 
-        if not groq_client:
-            raise HTTPException(status_code=503, detail="Servico de IA nao disponivel")
+def build_answer_messages(question: str, context: str) -> list:
+    """Mensagens para a resposta final: instrucoes fixas primeiro, pergunta e contexto (variaveis) por ultimo"""
+    return [
+        {"role": "system", "content": ANSWER_SYSTEM_PROMPT},
+        {"role": "user", "content": f"PERGUNTA DO USUARIO:\n{question}\n\nCONTEXTO DO DOCUMENTO:\n{context}\n\nRESPOSTA:"}
+    ]
 
-        # Busca melhorada
-        context_parts, sources = smart_text_search(
-            query=question,
-            file_id=file_id,
-            user_email=user_email,
-            max_results=10
-        )
+def validate_chat_request(request: ChatRequest) -> tuple:
+    """Valida a requisicao e retorna pergunta, arquivo e usuario"""
+    question = request.question
+    file_id = request.file_id
+    user_email = request.user_email or DEFAULT_USER_EMAIL
+    
+    if not question:
+        raise HTTPException(status_code=400, detail='Pergunta obrigatoria')
 
-        if not context_parts:
-            logger.warning(f"Nenhum contexto encontrado para: {question}")
-            answer = "Nao encontrei informacoes relevantes no arquivo para responder essa pergunta.\n\nDicas para melhor resultado:\n\n1. Use palavras-chave especificas do documento\n2. Tente reformular a pergunta de forma mais direta\n3. Verifique se o conteudo esta relacionado ao arquivo enviado"
-            
-            save_to_history(user_email, question, answer, [], file_id)
-            
-            return {
-                'answer': answer,
+    if not file_id:
+        raise HTTPException(status_code=400, detail='ID do arquivo obrigatorio')
+
+    logger.info(f"Pergunta recebida: {question} (usuario: {user_email})")
+    return question, file_id, user_email
+
+def fit_context(context_parts: list, sources: list) -> tuple:
+    """Mantem os chunks, em ordem de score, enquanto o contexto couber em MAX_CONTEXT_CHARS"""
+    total_length = len(context_parts[0])
+    kept = 1
+    for part in context_parts[1:]:
+        total_length += len(CONTEXT_SEPARATOR) + len(part)
+        if total_length > MAX_CONTEXT_CHARS:
+            break
+        kept += 1
+    
+    if kept < len(context_parts):
+        logger.info(f"Contexto limitado a {kept} de {len(context_parts)} partes ({MAX_CONTEXT_CHARS} caracteres)")
+    return context_parts[:kept], sources[:kept]
+
+async def prepare_answer(question: str, file_id: str, user_email: str) -> dict:
+    """Retorna uma resposta pronta (cache ou sem contexto) ou o contexto e mensagens para a IA"""
+    # Reaproveita resposta da mesma pergunta sobre o mesmo arquivo
+    # Chunks do arquivo consultados uma unica vez por pergunta
+    storage_key = f"{user_email}_{file_id}"
+    file_data = await get_text_data(storage_key)
+    cached = exact_answer_cache.get(exact_answer_key(storage_key, question)) if file_data else None
+    if cached:
+        logger.info(f"Resposta reaproveitada do cache para: {question}")
+        await asyncio.to_thread(save_to_history, user_email, question, cached['answer'], cached['sources'], file_id)
+        
+        return {
+            'response': {
+                'answer': cached['answer'],
+                'sources': cached['sources'],
+                'context': cached['context'],
+                'debug_info': {
+                    'chunks_found': cached['chunks_found'],
+                    'context_length': cached['context_length'],
+                    'best_scores': [s['score'] for s in cached['sources'][:3]],
+                    'file_id': file_id,
+                    'user_email': user_email,
+                    'search_type': 'exact_cache'
+                }
+            }
+        }
+
+    if not get_groq_client():
+        raise HTTPException(status_code=503, detail="Servico de IA nao disponivel")
+
+    # Busca melhorada
+    context_parts, sources = await smart_text_search(
+        query=question,
+        file_id=file_id,
+        file_data=file_data,
+        max_results=10
+    )
+
+    if not context_parts:
+        logger.warning(f"Nenhum contexto encontrado para: {question}")
+        await asyncio.to_thread(save_to_history, user_email, question, NO_CONTEXT_ANSWER, [], file_id)
+        
+        return {
+            'response': {
+                'answer': NO_CONTEXT_ANSWER,
                 'sources': [],
                 'context': '',
                 'debug_info': {
@@ -311,36 +639,58 @@ async def send_message(request: ChatRequest = Body(...)):
                     'search_type': 'enhanced_search'
                 }
             }
+        }
 
-        # Constroi contexto
-        context = "\n\n---\n\n".join(context_parts)
-        
-        logger.info(f"Contexto encontrado: {len(context_parts)} partes, {len(context)} caracteres")
+    # Constroi contexto com os chunks mais relevantes que cabem no limite (ja vem ordenados por score)
+    context_parts, sources = fit_context(context_parts, sources)
+    context = CONTEXT_SEPARATOR.join(context_parts)
+    
+    logger.info(f"Contexto encontrado: {len(context_parts)} partes, {len(context)} caracteres")
 
-        # Prompt melhorado
-        prompt = f"""Voce e um assistente especializado em analisar documentos e responder perguntas com base no conteudo fornecido.
+    return {
+        'storage_key': storage_key,
+        'context': context,
+        'chunks_found': len(context_parts),
+        'sources': sources,
+        'messages': build_answer_messages(question, context)
+    }
 
-PERGUNTA DO USUARIO:
-{question}
+def build_answer_response(answer: str, prepared: dict, file_id: str, user_email: str) -> dict:
+    """Monta a resposta do chat para uma resposta gerada pela IA"""
+    context = prepared['context']
+    sources = prepared['sources']
+    return {
+        'answer': answer,
+        'sources': sources,
+        'context': context[:400] + "..." if len(context) > 400 else context,
+        'debug_info': {
+            'chunks_found': prepared['chunks_found'],
+            'context_length': len(context),
+            'best_scores': [s['score'] for s in sources[:3]],
+            'file_id': file_id,
+            'user_email': user_email,
+            'search_type': 'enhanced_search'
+        }
+    }
 
-CONTEXTO DO DOCUMENTO:
-{context}
+def sse_event(payload: dict) -> bytes:
+    """Formata um evento Server-Sent Events"""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
 
-INSTRUCOES:
-- Responda APENAS com base no contexto fornecido
-- Se a informacao nao estiver no contexto, diga que nao encontrou no documento
-- Seja preciso e cite partes especificas quando relevante
-- Use linguagem clara e organize a resposta de forma estruturada
-- Se houver dados, numeros ou fatos especificos, mencione-os
-- Para perguntas sobre notas ou situacoes academicas, seja muito preciso nos valores e status
-- Quando houver multiplas ocorrencias de algo, liste todas claramente
-
-RESPOSTA:"""
+@router.post("")
+async def send_message(request: ChatRequest = Body(...)):
+    """Endpoint principal para chat"""
+    try:
+        question, file_id, user_email = validate_chat_request(request)
+        
+        prepared = await prepare_answer(question, file_id, user_email)
+        if 'response' in prepared:
+            return prepared['response']
 
         try:
-            response = groq_client.chat.completions.create(
+            response = await get_groq_client().chat.completions.create(
                 model="llama3-8b-8192",
-                messages=[{"role": "user", "content": prompt}],
+                messages=prepared['messages'],
                 max_tokens=1200,
                 temperature=0.1,
                 top_p=0.9
@@ -349,25 +699,15 @@ RESPOSTA:"""
             answer = response.choices[0].message.content
             logger.info(f"Resposta gerada: {len(answer)} caracteres")
             
+            cache_answer(prepared['storage_key'], question, answer, prepared['sources'], prepared['context'], prepared['chunks_found'])
+            
         except Exception as e:
             logger.error(f"Erro ao gerar resposta: {e}")
-            answer = "Erro ao processar sua pergunta. Tente novamente."
+            answer = ANSWER_ERROR_MESSAGE
 
-        save_to_history(user_email, question, answer, sources, file_id)
+        await asyncio.to_thread(save_to_history, user_email, question, answer, prepared['sources'], file_id)
 
-        return {
-            'answer': answer,
-            'sources': sources,
-            'context': context[:400] + "..." if len(context) > 400 else context,
-            'debug_info': {
-                'chunks_found': len(context_parts),
-                'context_length': len(context),
-                'best_scores': [s['score'] for s in sources[:3]],
-                'file_id': file_id,
-                'user_email': user_email,
-                'search_type': 'enhanced_search'
-            }
-        }
+        return build_answer_response(answer, prepared, file_id, user_email)
         
     except HTTPException:
         raise
@@ -375,12 +715,64 @@ RESPOSTA:"""
         logger.error(f"Erro interno: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Erro interno: {str(e)}")
 
+@router.post("/stream")
+async def send_message_stream(request: ChatRequest = Body(...)):
+    """Chat com a resposta enviada em partes (Server-Sent Events)"""
+    try:
+        question, file_id, user_email = validate_chat_request(request)
+        prepared = await prepare_answer(question, file_id, user_email)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Erro interno: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Erro interno: {str(e)}")
+
+    async def generate_events():
+        # Respostas prontas vao em um unico trecho, seguido do evento final
+        if 'response' in prepared:
+            yield sse_event({'delta': prepared['response']['answer']})
+            yield sse_event({'done': True, **prepared['response']})
+            return
+        
+        answer_parts = []
+        try:
+            stream = await get_groq_client().chat.completions.create(
+                model="llama3-8b-8192",
+                messages=prepared['messages'],
+                max_tokens=1200,
+                temperature=0.1,
+                top_p=0.9,
+                stream=True
+            )
+            
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    answer_parts.append(delta)
+                    yield sse_event({'delta': delta})
+            
+            answer = ''.join(answer_parts)
+            logger.info(f"Resposta gerada (stream): {len(answer)} caracteres")
+            
+            cache_answer(prepared['storage_key'], question, answer, prepared['sources'], prepared['context'], prepared['chunks_found'])
+            
+        except Exception as e:
+            logger.error(f"Erro ao gerar resposta: {e}")
+            answer = ANSWER_ERROR_MESSAGE
+            yield sse_event({'error': answer})
+        
+        await asyncio.to_thread(save_to_history, user_email, question, answer, prepared['sources'], file_id)
+        
+        yield sse_event({'done': True, **build_answer_response(answer, prepared, file_id, user_email)})
+
+    return StreamingResponse(generate_events(), media_type="text/event-stream")
+
 @router.get("/status")
 async def chat_status():
     """Status dos servicos"""
     
-    groq_status = groq_client is not None
-    storage_files = len(text_storage)
+    groq_status = get_groq_client() is not None
+    storage_files, history_users = await asyncio.to_thread(get_storage_stats)
     
     response = {
         "status": "ok" if groq_status else "partial",
@@ -395,9 +787,10 @@ async def chat_status():
         "details": {
             "groq_model": "llama3-8b-8192" if groq_status else "Nao disponivel",
             "search_type": "enhanced_contextual_search",
-            "storage_type": "in_memory_by_user",
+            "storage_type": "sqlite_by_user",
             "files_indexed": storage_files,
-            "history_users": len(history_storage),
+            "files_cached": len(text_storage),
+            "history_users": history_users,
             "improvements": [
                 "deteccao_contexto_documento",
                 "extracao_entidades",
@@ -410,23 +803,206 @@ async def chat_status():
     
     return response
 
-def get_user_history(user_email: str) -> list:
-    """Obtem historico do usuario"""
-    return history_storage.get(user_email, [])
+def get_storage_stats() -> tuple:
+    """Quantidade de arquivos com chunks e de usuarios com historico"""
+    from routes.upload import db_lock, get_db_connection
+    
+    with db_lock:
+        connection = get_db_connection()
+        storage_files = connection.execute("SELECT COUNT(*) FROM text_chunks").fetchone()[0]
+        history_users = connection.execute("SELECT COUNT(DISTINCT user_email) FROM chat_history").fetchone()[0]
+    return storage_files, history_users
+
+def get_user_history(user_email: str, newest_first: bool = False) -> list:
+    """Obtem historico do usuario, em ordem de insercao (ou da mais recente)"""
+    from routes.upload import db_lock, get_db_connection
+    
+    order = "DESC" if newest_first else "ASC"
+    with db_lock:
+        rows = get_db_connection().execute(
+            f"SELECT item FROM chat_history WHERE user_email = ? ORDER BY id {order}", (user_email,)
+        ).fetchall()
+    return [orjson.loads(row['item']) for row in rows]
+
+def get_all_histories() -> dict:
+    """Obtem o historico de todos os usuarios"""
+    from routes.upload import db_lock, get_db_connection
+    
+    with db_lock:
+        rows = get_db_connection().execute(
+            "SELECT user_email, item FROM chat_history ORDER BY id"
+        ).fetchall()
+    
+    histories = {}
+    for row in rows:
+        histories.setdefault(row['user_email'], []).append(orjson.loads(row['item']))
+    return histories
+
+def clear_user_history(user_email: str) -> int:
+    """Remove o historico do usuario e retorna quantos itens foram removidos"""
+    from routes.upload import db_lock, get_db_connection
+    
+    with db_lock:
+        connection = get_db_connection()
+        cursor = connection.execute("DELETE FROM chat_history WHERE user_email = ?", (user_email,))
+        connection.commit()
+    return cursor.rowcount
+
+def build_text_data(chunks: list, created_at: str) -> dict:
+    """Monta os dados de busca de um arquivo a partir dos chunks"""
+    # Versoes em minusculas e palavras de cada chunk sao calculadas uma unica vez; cada palavra
+    # distinta e um unico objeto str, referenciado por todos os chunks em que aparece
+    chunks_lower = [chunk.lower() for chunk in chunks]
+    distinct_words = {}
+    chunks_words = [
+        [distinct_words.setdefault(word, word) for word in WORD_RE.findall(chunk_lower)]
+        for chunk_lower in chunks_lower
+    ]
+    
+    # Vocabulario (palavras com mais de 3 letras) e em quais chunks cada palavra aparece
+    word_chunks = {}
+    for i, words in enumerate(chunks_words):
+        for word in set(words):
+            if len(word) > 3:
+                word_chunks.setdefault(word, []).append(i)
+    vocabulary = sorted(word_chunks)
+    
+    # Contexto e entidades dependem apenas do inicio do documento
+    full_text = ' '.join(chunks[:3])
+    doc_context = detect_document_context(full_text)
+    
+    return {
+        'chunks': chunks,
+        'chunks_lower': chunks_lower,
+        'chunks_words': chunks_words,
+        'doc_context': doc_context,
+        'entities': extract_key_entities(full_text, doc_context),
+        'vocabulary': vocabulary,
+        'word_chunks': word_chunks,
+        'memory_size': estimate_file_data_size(chunks, chunks_lower, chunks_words, distinct_words, vocabulary, word_chunks),
+        'created_at': created_at,
+        'total_chunks': len(chunks)
+    }
 
-def save_text_chunks(file_id: str, chunks: list, user_email: str = DEFAULT_USER_EMAIL):
+def cache_text_data(storage_key: str, text_data: dict):
+    """Guarda os dados no cache local; arquivos maiores que o limite ficam apenas no banco"""
+    try:
+        text_storage[storage_key] = text_data
+    except ValueError:
+        logger.warning(f"text_storage: '{storage_key}' maior que o limite do cache, lido do banco a cada consulta")
+
+def text_chunks_cutoff() -> str:
+    """created_at mais antigo ainda valido (ISO, comparavel como texto)"""
+    return (datetime.now() - timedelta(seconds=TEXT_CHUNKS_TTL)).isoformat()
+
+def purge_expired_text_chunks() -> int:
+    """Remove do banco os chunks que passaram do TTL"""
+    from routes.upload import db_lock, get_db_connection
+    
+    with db_lock:
+        connection = get_db_connection()
+        cursor = connection.execute("DELETE FROM text_chunks WHERE created_at < ?", (text_chunks_cutoff(),))
+        connection.commit()
+    if cursor.rowcount:
+        logger.info(f"Chunks expirados removidos: {cursor.rowcount} arquivos")
+    return cursor.rowcount
+
+def load_text_data(storage_key: str, cached_created_at: Optional[str]) -> tuple:
+    """Consulta o banco (executado fora do event loop): (created_at, dados de busca reconstruidos);
+    created_at None se o arquivo nao existe ou expirou, dados None se o cache local esta em dia"""
+    from routes.upload import db_lock, get_db_connection
+    
+    with db_lock:
+        connection = get_db_connection()
+        row = connection.execute(
+            "SELECT created_at FROM text_chunks WHERE storage_key = ?", (storage_key,)
+        ).fetchone()
+        # Chunks expirados contam como removidos
+        if row is not None and row['created_at'] < text_chunks_cutoff():
+            connection.execute("DELETE FROM text_chunks WHERE storage_key = ?", (storage_key,))
+            connection.commit()
+            row = None
+    
+    if row is None:
+        return None, None
+    if row['created_at'] == cached_created_at:
+        return cached_created_at, None
+    
+    with db_lock:
+        row = get_db_connection().execute(
+            "SELECT chunks, created_at FROM text_chunks WHERE storage_key = ?", (storage_key,)
+        ).fetchone()
+    if row is None:
+        return None, None
+    return row['created_at'], build_text_data(orjson.loads(row['chunks']), row['created_at'])
+
+async def get_text_data(storage_key: str) -> Optional[dict]:
+    """Obtem os chunks de um arquivo, usando o cache local enquanto ele estiver em dia com o banco"""
+    # Banco e reconstrucao dos indices em outra thread; o cache local so e alterado no event loop
+    cached = text_storage.get(storage_key)
+    created_at, text_data = await asyncio.to_thread(
+        load_text_data, storage_key, cached['created_at'] if cached else None
+    )
+    
+    # Arquivo removido (possivelmente por outro worker) ou expirado
+    if created_at is None:
+        if text_storage.pop(storage_key, None) is not None:
+            clear_cached_answers(storage_key)
+        return None
+    
+    if text_data is None:
+        return cached
+    
+    cache_text_data(storage_key, text_data)
+    logger.info(f"Chunks carregados do banco para {storage_key}")
+    return text_data
+
+def write_text_chunks(storage_key: str, chunks: list) -> dict:
+    """Grava os chunks no banco e monta os dados de busca (executado fora do event loop)"""
+    from routes.upload import db_lock, get_db_connection
+    
+    created_at = datetime.now().isoformat()
+    with db_lock:
+        connection = get_db_connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO text_chunks (storage_key, chunks, created_at) VALUES (?, ?, ?)",
+            (storage_key, orjson.dumps(chunks).decode(), created_at)
+        )
+        # Aproveita a escrita para limpar os chunks expirados de arquivos nao consultados
+        connection.execute("DELETE FROM text_chunks WHERE created_at < ?", (text_chunks_cutoff(),))
+        connection.commit()
+    
+    return build_text_data(chunks, created_at)
+
+async def save_text_chunks(file_id: str, chunks: list, user_email: str = DEFAULT_USER_EMAIL):
     """Salva chunks no armazenamento"""
     try:
         storage_key = f"{user_email}_{file_id}"
-        text_storage[storage_key] = {
-            'chunks': chunks,
-            'created_at': datetime.now().isoformat(),
-            'total_chunks': len(chunks)
-        }
+        
+        # Banco e indices em outra thread; o cache local so e alterado no event loop
+        text_data = await asyncio.to_thread(write_text_chunks, storage_key, chunks)
+        cache_text_data(storage_key, text_data)
         
         logger.info(f"Salvos {len(chunks)} chunks para arquivo {file_id} (usuario: {user_email})")
         return True
         
     except Exception as e:
         logger.error(f"Erro ao salvar chunks: {e}")
-        return False
\ No newline at end of file
+        return False
+
+def remove_text_chunks(storage_key: str) -> bool:
+    """Remove os chunks de um arquivo do banco (executado fora do event loop)"""
+    from routes.upload import db_lock, get_db_connection
+    
+    with db_lock:
+        connection = get_db_connection()
+        cursor = connection.execute("DELETE FROM text_chunks WHERE storage_key = ?", (storage_key,))
+        connection.commit()
+    return cursor.rowcount > 0
+
+async def delete_text_chunks(storage_key: str) -> bool:
+    """Remove os chunks de um arquivo do banco, do cache local e as respostas guardadas"""
+    # O cache local so e alterado no event loop; o banco em outra thread
+    text_storage.pop(storage_key, None)
+    clear_cached_answers(storage_key)
+    return await asyncio.to_thread(remove_text_chunks, storage_key)
@@ -1,7 +1,9 @@
 from fastapi import APIRouter, HTTPException, Query
 from typing import Optional
+import asyncio
 import logging
 from datetime import datetime
+from collections import Counter
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -16,14 +18,8 @@ async def get_history(user_email: Optional[str] = Query(default=DEFAULT_USER_EMA
         
         email = user_email or DEFAULT_USER_EMAIL
         
-        history = get_user_history(email)
-        
-        # Ordena por timestamp mais recente
-        if history:
-            try:
-                history.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
-            except Exception as e:
-                logger.warning(f"Erro ao ordenar historico: {e}")
+        # Mais recentes primeiro, direto da ordem de insercao (sem ordenar por timestamp)
+        history = await asyncio.to_thread(get_user_history, email, newest_first=True)
         
         logger.info(f"Historico solicitado para {email}: {len(history)} itens")
         
@@ -42,13 +38,12 @@ async def get_history(user_email: Optional[str] = Query(default=DEFAULT_USER_EMA
 async def clear_history(user_email: Optional[str] = Query(default=DEFAULT_USER_EMAIL)):
     """Limpa historico de conversas do usuario"""
     try:
-        from routes.chat import history_storage
+        from routes.chat import clear_user_history
         
         email = user_email or DEFAULT_USER_EMAIL
         
-        if email in history_storage:
-            items_count = len(history_storage[email])
-            del history_storage[email]
+        items_count = await asyncio.to_thread(clear_user_history, email)
+        if items_count:
             logger.info(f"Historico limpo para {email}: {items_count} itens removidos")
             
             return {
@@ -76,7 +71,7 @@ async def history_stats(user_email: Optional[str] = Query(default=DEFAULT_USER_E
         from routes.chat import get_user_history
         
         email = user_email or DEFAULT_USER_EMAIL
-        history = get_user_history(email)
+        history = await asyncio.to_thread(get_user_history, email)
         
         if not history:
             return {
@@ -98,16 +93,11 @@ async def history_stats(user_email: Optional[str] = Query(default=DEFAULT_USER_E
         first_conversation = timestamps[0] if timestamps else None
         last_conversation = timestamps[-1] if timestamps else None
         
-        # Analisa dias mais ativos
-        days_activity = {}
-        for item in history:
-            if item.get('timestamp'):
-                try:
-                    date = datetime.fromisoformat(item['timestamp'].replace('Z', '+00:00'))
-                    day_key = date.strftime('%Y-%m-%d')
-                    days_activity[day_key] = days_activity.get(day_key, 0) + 1
-                except:
-                    continue
+        # Analisa dias mais ativos (data gravada junto com o item; itens antigos usam o prefixo do timestamp)
+        days_activity = Counter(
+            item.get('date') or item['timestamp'][:10]
+            for item in history if item.get('date') or item.get('timestamp')
+        )
         
         most_active_day = max(days_activity, key=days_activity.get) if days_activity else None
         
@@ -136,7 +126,7 @@ async def search_history(
         from routes.chat import get_user_history
         
         email = user_email or DEFAULT_USER_EMAIL
-        history = get_user_history(email)
+        history = await asyncio.to_thread(get_user_history, email)
         
         if not history or not query.strip():
             return {
@@ -147,6 +137,7 @@ async def search_history(
             }
         
         query_lower = query.lower().strip()
+        query_words = [word for word in query_lower.split() if len(word) > 2]
         results = []
         
         for item in history:
@@ -166,13 +157,11 @@ async def search_history(
                 matched_in.append('answer')
             
             # Busca por palavras individuais
-            query_words = query_lower.split()
             for word in query_words:
-                if len(word) > 2:
-                    if word in question:
-                        score += 1
-                    if word in answer:
-                        score += 0.5
+                if word in question:
+                    score += 1
+                if word in answer:
+                    score += 0.5
             
             if score > 0:
                 results.append({
@@ -202,14 +191,15 @@ async def search_history(
 async def history_status():
     """Status do servico de historico"""
     try:
-        from routes.chat import history_storage
+        from routes.chat import get_all_histories
         
-        total_users = len(history_storage)
-        total_items = sum(len(history) for history in history_storage.values())
+        histories = await asyncio.to_thread(get_all_histories)
+        total_users = len(histories)
+        total_items = sum(len(history) for history in histories.values())
         
         # Calcula estatisticas gerais
         users_with_history = []
-        for user_email, user_history in history_storage.items():
+        for user_email, user_history in histories.items():
             if user_history:
                 users_with_history.append({
                     "user": user_email,
@@ -225,7 +215,7 @@ async def history_status():
             "total_users": total_users,
             "total_items": total_items,
             "active_users": len(users_with_history),
-            "storage_type": "in_memory_by_user",
+            "storage_type": "sqlite_by_user",
             "default_user": DEFAULT_USER_EMAIL,
             "features": {
                 "session_isolation": True,
@@ -237,7 +227,7 @@ async def history_status():
             "system_stats": {
                 "average_conversations_per_user": round(total_items / max(total_users, 1), 2),
                 "max_conversations_per_user": max(
-                    (len(history) for history in history_storage.values()),
+                    (len(history) for history in histories.values()),
                     default=0
                 )
             }
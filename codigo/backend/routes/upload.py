@@ -1,21 +1,38 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, status, Form
-from typing import Optional
+from fastapi import APIRouter, HTTPException, Request, status
+from typing import Optional, TYPE_CHECKING
 import os
+import asyncio
 import uuid
-import json
+import orjson
+import sqlite3
+import threading
+import hashlib
+import bisect
+import itertools
 from datetime import datetime
 import logging
-from dotenv import load_dotenv
-from pypdf import PdfReader
-from groq import Groq
 import re
+import ahocorasick
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from cachetools import TTLCache
+from streaming_form_data import StreamingFormDataParser
+from streaming_form_data.targets import BaseTarget, ValueTarget
+
+# Reutiliza o cliente Groq (e seu pool de conexoes) e o TTL dos chunks do modulo de chat
+from routes.chat import get_groq_client, text_chunks_cutoff
+
+if TYPE_CHECKING:
+    import pymupdf
 
-load_dotenv()
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
 UPLOAD_DIR = "user_files"
 USER_DATA_FILE = "user_files_data.json"
+USER_DATA_DB = "user_files_data.db"
 
 try:
     os.makedirs(UPLOAD_DIR, exist_ok=True)
@@ -24,35 +41,259 @@ except Exception as e:
     logger.error(f"Erro ao criar diretorio: {e}")
 
 MAX_FILE_SIZE = 25 * 1024 * 1024
+# Folga para o restante do multipart (boundaries, cabecalhos e o campo user_email)
+MAX_UPLOAD_BODY_SIZE = MAX_FILE_SIZE + 64 * 1024
+
+# Leitores de PDF aceitam o cabecalho %PDF em qualquer ponto do primeiro KB
+PDF_HEADER = b'%PDF'
+PDF_HEADER_WINDOW = 1024
+
+# Resumos ja gerados para o mesmo prompt (arquivo, tipo e amostra de texto), evitando nova chamada a IA
+SUMMARY_CACHE_SIZE = 256
+SUMMARY_CACHE_TTL = 24 * 3600
+summary_cache = TTLCache(maxsize=SUMMARY_CACHE_SIZE, ttl=SUMMARY_CACHE_TTL)
+# Abaixo deste tamanho o resumo e o texto padrao, sem chamada a IA
+MIN_SUMMARY_TEXT_LENGTH = 1500
+
+class PdfUploadTarget(BaseTarget):
+    """Recebe o PDF do multipart direto em memoria, calculando o hash e limitando o tamanho"""
+    def __init__(self):
+        super().__init__()
+        self.data = bytearray()
+        self.hasher = hashlib.sha256()
+        self.header_checked = False
+    
+    def on_start(self):
+        # So a extensao e convertida para minusculas, nao o nome inteiro
+        if (self.multipart_filename or '')[-4:].lower() != '.pdf':
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Apenas arquivos PDF sao aceitos"
+            )
+    
+    def on_data_received(self, chunk: bytes):
+        if len(self.data) + len(chunk) > MAX_FILE_SIZE:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"Arquivo muito grande. Maximo: {MAX_FILE_SIZE//(1024*1024)}MB"
+            )
+        self.hasher.update(chunk)
+        self.data += chunk
+        
+        # Confere o cabecalho assim que os primeiros bytes chegam, sem esperar o arquivo inteiro
+        if not self.header_checked and len(self.data) >= PDF_HEADER_WINDOW:
+            self.check_pdf_header()
+    
+    def on_finish(self):
+        if not self.header_checked:
+            self.check_pdf_header()
+    
+    def check_pdf_header(self):
+        self.header_checked = True
+        if PDF_HEADER not in self.data[:PDF_HEADER_WINDOW]:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Apenas arquivos PDF sao aceitos"
+            )
+
+# Operador de inicio de bloco de texto no content stream do PDF
+TEXT_OPERATOR_PATTERN = re.compile(rb'\bBT\b')
+
+# Limpeza do texto e divisao por paginas
+BLANK_LINES_PATTERN = re.compile(r'\n\s*\n\s*\n+')
+# Apenas sequencias de 2+ espacos precisam ser trocadas (mesmo resultado de ' +')
+SPACES_PATTERN = re.compile(r' {2,}')
+# Trocas fixas de sequencias de UTF-8 lidas como latin-1/cp1252 (aspas viram ASCII;
+# 'â€' cobre a aspa final cujo terceiro byte se perde)
+MOJIBAKE_REPLACEMENTS = {
+    'â€™': "'",
+    'â€œ': '"',
+    'â€\x9d': '"',
+    'â€': '"',
+    'Ã©': 'é',
+    'Ã¡': 'á',
+    'Ã§': 'ç',
+    'Ã£': 'ã',
+    'Ãº': 'ú',
+    'Ã\xad': 'í',
+    'Ã³': 'ó',
+}
+
+# Bytes iniciais que o mojibake de texto em portugues produz: 0xC3 ('Ã', letras acentuadas),
+# 0xC2 ('Â', simbolos como ° e º) e 0xE2 ('â', aspas e travessoes). Letras maiusculas acentuadas
+# como 'É' e 'Ê' tambem sao bytes iniciais validos, mas aparecem em texto correto ('JOSÉ”')
+MOJIBAKE_LEAD_CHARS = 'ÃÂâ'
+# Apos 'Ã' no fim de palavra ('IRMÃ”'), aspa ou » e pontuacao real, nao 'Ô'/'Ò'/'û'
+MOJIBAKE_CLOSING_CHARS = {'”', '’', '»'}
+
+def build_mojibake_pattern():
+    """Monta o regex de 'Ã', 'Â' ou 'â' seguido de bytes de continuacao de UTF-8, lidos como latin-1/cp1252"""
+    byte_values = {}
+    for byte in range(0x80, 0x100):
+        byte_values[bytes([byte]).decode('latin-1')] = byte
+        try:
+            byte_values[bytes([byte]).decode('cp1252')] = byte
+        except UnicodeDecodeError:
+            pass
+    
+    continuation = '[' + ''.join(re.escape(char) for char, byte in byte_values.items() if 0x80 <= byte <= 0xBF) + ']'
+    return byte_values, re.compile('[' + MOJIBAKE_LEAD_CHARS + ']' + continuation + '{1,2}')
+
+MOJIBAKE_BYTES, MOJIBAKE_PATTERN = build_mojibake_pattern()
+
+def fix_mojibake(match: re.Match) -> str:
+    """Troca o maior prefixo que seja uma troca fixa ou UTF-8 valido; sem nenhum, mantem o texto"""
+    sequence = match.group()
+    for length in range(len(sequence), 1, -1):
+        prefix = sequence[:length]
+        replacement = MOJIBAKE_REPLACEMENTS.get(prefix)
+        if replacement is None:
+            if length == 2 and prefix[1] in MOJIBAKE_CLOSING_CHARS:
+                following = sequence[2:3] or match.string[match.end():match.end() + 1]
+                if not following.isalpha():
+                    continue
+            try:
+                replacement = bytes(MOJIBAKE_BYTES[char] for char in prefix).decode('utf-8')
+            except UnicodeDecodeError:
+                continue
+        return replacement + sequence[length:]
+    return sequence
+
+PAGE_MARKER_PATTERN = re.compile(r'\n=== Pagina \d+ ===\n')
+# Palavras do chunking alternativo (mesma divisao de str.split())
+WORD_PATTERN = re.compile(r'\S+')
+FALLBACK_MAX_WORDS = 5000
+
+# Separadores de quebra natural dos chunks, em ordem de prioridade
+CHUNK_SEPARATORS = ["\n\n", "\n", ". ", "! ", "? ", ": ", "; ", ", "]
+SEPARATOR_PATTERNS = [(sep, re.compile(f"(?={re.escape(sep)})")) for sep in CHUNK_SEPARATORS]
 
 DEFAULT_USER_EMAIL = "usuario@askfile.com"
 
-groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+# Colunas da tabela de arquivos (demais campos, como processing_stats, vao em JSON)
+FILE_COLUMNS = [
+    "original_name", "file_path", "summary", "upload_date", "file_size",
+    "content_hash", "chunks_count", "text_length", "file_removed"
+]
 
-user_files_data = {}
+db_lock = threading.Lock()
+db_connection = None
 
-def load_user_files_data():
-    """Carrega dados dos arquivos"""
-    global user_files_data
-    try:
-        if os.path.exists(USER_DATA_FILE):
-            with open(USER_DATA_FILE, 'r', encoding='utf-8') as f:
-                user_files_data = json.load(f)
-            logger.info(f"Dados carregados: {len(user_files_data)} usuarios")
-    except Exception as e:
-        logger.error(f"Erro ao carregar dados: {e}")
-        user_files_data = {}
+def get_db_connection() -> sqlite3.Connection:
+    """Abre (uma unica vez) a conexao SQLite em modo WAL"""
+    global db_connection
+    if db_connection is None:
+        db_connection = sqlite3.connect(USER_DATA_DB, check_same_thread=False)
+        db_connection.row_factory = sqlite3.Row
+        db_connection.execute("PRAGMA journal_mode=WAL")
+        db_connection.execute("PRAGMA synchronous=NORMAL")
+        db_connection.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                file_id TEXT PRIMARY KEY,
+                user_email TEXT NOT NULL,
+                original_name TEXT,
+                file_path TEXT,
+                summary TEXT,
+                upload_date TEXT,
+                file_size INTEGER,
+                content_hash TEXT,
+                chunks_count INTEGER,
+                text_length INTEGER,
+                file_removed INTEGER,
+                extra_data TEXT
+            )
+        """)
+        db_connection.execute("CREATE INDEX IF NOT EXISTS idx_files_user ON files(user_email)")
+        db_connection.execute("CREATE INDEX IF NOT EXISTS idx_files_hash ON files(user_email, content_hash)")
+        db_connection.execute("CREATE INDEX IF NOT EXISTS idx_files_content_hash ON files(content_hash)")
+        # Chunks e historico do chat, compartilhados entre workers
+        db_connection.execute("""
+            CREATE TABLE IF NOT EXISTS text_chunks (
+                storage_key TEXT PRIMARY KEY,
+                chunks TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            )
+        """)
+        db_connection.execute("CREATE INDEX IF NOT EXISTS idx_text_chunks_created ON text_chunks(created_at)")
+        db_connection.execute("""
+            CREATE TABLE IF NOT EXISTS chat_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_email TEXT NOT NULL,
+                item TEXT NOT NULL
+            )
+        """)
+        db_connection.execute("CREATE INDEX IF NOT EXISTS idx_history_user ON chat_history(user_email, id)")
+        db_connection.commit()
+    return db_connection
+
+def row_to_file_data(row: sqlite3.Row) -> dict:
+    """Converte uma linha da tabela no formato de dados do arquivo"""
+    file_data = {column: row[column] for column in FILE_COLUMNS}
+    file_data['file_removed'] = bool(row['file_removed'])
+    if row['extra_data']:
+        file_data.update(orjson.loads(row['extra_data']))
+    return file_data
+
+def save_file_data(user_email: str, file_id: str, file_data: dict):
+    """Insere ou atualiza os dados de um arquivo"""
+    values = [file_data.get(column) for column in FILE_COLUMNS]
+    extra_data = {key: value for key, value in file_data.items() if key not in FILE_COLUMNS}
+    with db_lock:
+        connection = get_db_connection()
+        connection.execute(
+            f"INSERT OR REPLACE INTO files (file_id, user_email, {', '.join(FILE_COLUMNS)}, extra_data) "
+            f"VALUES (?, ?, {', '.join('?' for _ in FILE_COLUMNS)}, ?)",
+            [file_id, user_email, *values, orjson.dumps(extra_data, default=str).decode()]
+        )
+        connection.commit()
 
-def save_user_files_data():
-    """Salva dados dos arquivos"""
+def delete_file_data(user_email: str, file_id: str):
+    """Remove os dados de um arquivo"""
+    with db_lock:
+        connection = get_db_connection()
+        connection.execute("DELETE FROM files WHERE user_email = ? AND file_id = ?", (user_email, file_id))
+        connection.commit()
+
+def get_file_data(user_email: str, file_id: str) -> Optional[dict]:
+    """Obtem os dados de um arquivo do usuario"""
+    with db_lock:
+        row = get_db_connection().execute(
+            "SELECT * FROM files WHERE user_email = ? AND file_id = ?", (user_email, file_id)
+        ).fetchone()
+    return row_to_file_data(row) if row else None
+
+def get_user_files_data(user_email: str) -> dict:
+    """Obtem os dados de todos os arquivos do usuario"""
+    with db_lock:
+        rows = get_db_connection().execute(
+            "SELECT * FROM files WHERE user_email = ? ORDER BY rowid", (user_email,)
+        ).fetchall()
+    return {row['file_id']: row_to_file_data(row) for row in rows}
+
+def get_files_stats() -> tuple:
+    """Total de arquivos, de chunks e de usuarios"""
+    with db_lock:
+        return tuple(get_db_connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(chunks_count), 0), COUNT(DISTINCT user_email) FROM files"
+        ).fetchone())
+
+def migrate_user_files_data():
+    """Importa o antigo user_files_data.json quando o banco ainda esta vazio"""
     try:
-        with open(USER_DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(user_files_data, f, ensure_ascii=False, indent=2, default=str)
-        logger.info(f"Dados salvos: {len(user_files_data)} usuarios")
+        with db_lock:
+            has_rows = get_db_connection().execute("SELECT 1 FROM files LIMIT 1").fetchone()
+        if has_rows or not os.path.exists(USER_DATA_FILE):
+            return
+        
+        with open(USER_DATA_FILE, 'rb') as f:
+            legacy_data = orjson.loads(f.read())
+        
+        for user_email, files in legacy_data.items():
+            for file_id, file_data in files.items():
+                save_file_data(user_email, file_id, file_data)
+        logger.info(f"Dados migrados do JSON: {len(legacy_data)} usuarios")
     except Exception as e:
-        logger.error(f"Erro ao salvar dados: {e}")
-
-load_user_files_data()
+        logger.error(f"Erro ao migrar dados: {e}")
 
 def clean_text(text: str) -> str:
     """Limpa e normaliza o texto extraido"""
@@ -60,41 +301,64 @@ def clean_text(text: str) -> str:
         return ""
     
     # Remove quebras de linha excessivas
-    text = re.sub(r'\n\s*\n\s*\n+', '\n\n', text)
+    text = BLANK_LINES_PATTERN.sub('\n\n', text)
     
     # Normaliza espacos
-    text = re.sub(r' +', ' ', text)
+    text = SPACES_PATTERN.sub(' ', text)
     
     # Remove espacos no inicio e fim
     text = text.strip()
     
-    # Corrige encoding issues comuns
-    text = text.replace('â€™', "'")
-    text = text.replace('â€œ', '"')
-    text = text.replace('â€', '"')
-    text = text.replace('Ã©', 'é')
-    text = text.replace('Ã¡', 'á')
-    text = text.replace('Ã§', 'ç')
-    text = text.replace('Ã£', 'ã')
-    text = text.replace('Ãº', 'ú')
-    text = text.replace('Ã­', 'í')
-    text = text.replace('Ã³', 'ó')
+    # Corrige UTF-8 lido como latin-1/cp1252 (todas as trocas em uma unica passada)
+    text = MOJIBAKE_PATTERN.sub(fix_mojibake, text)
     
     return text
 
-def extract_text_from_pdf(file_path: str) -> str:
-    """Extrai texto do PDF com tratamento melhorado"""
+def page_has_text(document: "pymupdf.Document", page: "pymupdf.Page") -> bool:
+    """Verifica rapidamente se a pagina possui operadores de texto (ignora paginas escaneadas)"""
+    try:
+        for xref in page.get_contents():
+            if TEXT_OPERATOR_PATTERN.search(document.xref_stream(xref) or b''):
+                return True
+        
+        # Texto tambem pode estar dentro de XObjects de formulario
+        return bool(page.get_xobjects())
+        
+    except Exception:
+        # Na duvida, deixa o extrator completo decidir
+        return True
+
+def open_pdf_document(pdf_bytes: bytes) -> "pymupdf.Document":
+    """Abre o PDF direto da memoria, uma unica vez para todo o processamento"""
+    # Importado sob demanda: so carrega o MuPDF quando um PDF e enviado
+    import pymupdf
+    
+    try:
+        return pymupdf.open(stream=pdf_bytes, filetype="pdf")
+    except Exception as e:
+        logger.error(f"Erro ao abrir PDF: {e}")
+        raise HTTPException(status_code=400, detail=f"Erro ao processar PDF: {str(e)}")
+
+def extract_text_from_pdf(document: "pymupdf.Document") -> tuple:
+    """Extrai texto do PDF com tratamento melhorado, junto com o numero de paginas com texto"""
     try:
-        reader = PdfReader(file_path)
         text_parts = []
         max_pages = 50
         
-        total_pages = min(len(reader.pages), max_pages)
+        total_pages = min(document.page_count, max_pages)
         
         for page_num in range(total_pages):
             try:
-                page = reader.pages[page_num]
-                page_text = page.extract_text()
+                page = document[page_num]
+                
+                # Pula paginas sem texto (imagens escaneadas)
+                if not page_has_text(document, page):
+                    logger.info(f"Pagina {page_num + 1} sem texto, ignorada")
+                    continue
+                
+                # Blocos ja agrupados pelo parser nativo (tipo 0 = texto)
+                blocks = page.get_text("blocks")
+                page_text = "\n".join(block[4] for block in blocks if block[6] == 0)
                 
                 if page_text and page_text.strip():
                     # Limpa o texto da pagina
@@ -120,33 +384,63 @@ def extract_text_from_pdf(file_path: str) -> str:
             full_text = full_text[:max_total] + "\n\n[Documento truncado]"
         
         logger.info(f"Texto extraido: {len(full_text):,} caracteres de {total_pages} paginas")
-        return full_text
+        return full_text, len(text_parts)
         
     except Exception as e:
         logger.error(f"Erro ao extrair texto: {e}")
         raise HTTPException(status_code=400, detail=f"Erro ao processar PDF: {str(e)}")
 
-def generate_summary(text: str, filename: str) -> str:
+# Palavras-chave de cada tipo de documento, em ordem de prioridade
+DOCUMENT_TYPE_KEYWORDS = {
+    "academico": ['nota', 'disciplina', 'aprovado', 'reprovado', 'credito'],
+    "financeiro": ['valor', 'pagamento', 'fatura', 'debito'],
+    "juridico": ['processo', 'lei', 'artigo', 'tribunal'],
+    "medico": ['paciente', 'exame', 'medicamento'],
+}
+
+def build_document_type_automaton():
+    """Automato com as palavras-chave de todos os tipos de documento"""
+    automaton = ahocorasick.Automaton()
+    for doc_type, keywords in DOCUMENT_TYPE_KEYWORDS.items():
+        for keyword in keywords:
+            automaton.add_word(keyword, doc_type)
+    automaton.make_automaton()
+    return automaton
+
+DOCUMENT_TYPE_AUTOMATON = build_document_type_automaton()
+
+def detect_document_type(text: str) -> str:
+    """Tipo do documento em uma unica passada pelo texto (o primeiro tipo da lista com alguma palavra)"""
+    found_types = set()
+    for _, doc_type in DOCUMENT_TYPE_AUTOMATON.iter(text.lower()):
+        found_types.add(doc_type)
+        if len(found_types) == len(DOCUMENT_TYPE_KEYWORDS) or doc_type == "academico":
+            break
+    return next((doc_type for doc_type in DOCUMENT_TYPE_KEYWORDS if doc_type in found_types), "geral")
+
+async def generate_summary(text: str, filename: str) -> str:
     """Gera resumo usando Groq com prompt melhorado"""
     try:
+        groq_client = get_groq_client()
         if not groq_client:
             return f"Arquivo {filename} processado com {len(text)} caracteres. Faca perguntas sobre o conteudo."
         
+        # Documentos muito curtos nao compensam uma chamada a IA
+        if len(text) < MIN_SUMMARY_TEXT_LENGTH:
+            logger.info(f"Texto curto ({len(text)} caracteres), resumo pela IA ignorado")
+            return f"Arquivo {filename} processado com {len(text)} caracteres. Faca perguntas sobre o conteudo."
+        
         # Detecta tipo de documento
-        text_lower = text.lower()
-        doc_type = "geral"
-        
-        if any(word in text_lower for word in ['nota', 'disciplina', 'aprovado', 'reprovado', 'credito']):
-            doc_type = "academico"
-        elif any(word in text_lower for word in ['valor', 'pagamento', 'fatura', 'debito']):
-            doc_type = "financeiro"
-        elif any(word in text_lower for word in ['processo', 'lei', 'artigo', 'tribunal']):
-            doc_type = "juridico"
-        elif any(word in text_lower for word in ['paciente', 'exame', 'medicamento']):
-            doc_type = "medico"
+        doc_type = detect_document_type(text)
         
         text_sample = text[:8000] if len(text) > 8000 else text
         
+        cache_key = hashlib.blake2b(f"{filename}\0{doc_type}\0{text_sample}".encode(), digest_size=16).digest()
+        cached_summary = summary_cache.get(cache_key)
+        if cached_summary:
+            logger.info(f"Resumo reaproveitado do cache: {filename}")
+            return cached_summary
+        
         prompt = f"""Analise este documento PDF e crie um resumo detalhado em portugues:
 
 ARQUIVO: {filename}
@@ -166,7 +460,7 @@ Para documentos financeiros, mencione valores, datas, status de pagamentos.
 Seja especifico e mencione informacoes que podem ser uteis para consultas futuras.
 Use linguagem clara e objetiva."""
 
-        response = groq_client.chat.completions.create(
+        response = await groq_client.chat.completions.create(
             model="llama3-8b-8192",
             messages=[{"role": "user", "content": prompt}],
             max_tokens=600,
@@ -179,20 +473,36 @@ Use linguagem clara e objetiva."""
             return f"Arquivo {filename} processado com {len(text)} caracteres. Faca perguntas sobre o conteudo."
         
         logger.info(f"Resumo gerado: {len(summary)} caracteres")
+        summary_cache[cache_key] = summary
         return summary
         
     except Exception as e:
         logger.error(f"Erro ao gerar resumo: {e}")
         return f"Arquivo {filename} processado. Faca perguntas sobre o conteudo."
 
-def create_text_chunks(text: str, chunk_size: int = 1000, overlap: int = 150) -> list:
+def find_separator_positions(section: str) -> list:
+    """Mapeia uma unica vez as posicoes de cada separador na secao"""
+    return [
+        (separator, [match.start() for match in pattern.finditer(section)])
+        for separator, pattern in SEPARATOR_PATTERNS
+    ]
+
+def find_natural_break(separator_positions: list, window_start: int, end: int) -> int:
+    """Retorna o fim do chunk na ultima quebra natural dentro da janela"""
+    for separator, positions in separator_positions:
+        idx = bisect.bisect_right(positions, end - len(separator)) - 1
+        if idx >= 0 and positions[idx] >= window_start:
+            return positions[idx] + len(separator)
+    return end
+
+def create_text_chunks(text: str, chunk_size: int = 1000, overlap: int = 100) -> list:
     """Cria chunks de texto otimizados"""
     try:
         chunks = []
         max_chunks = 150
         
         # Pre-processamento: identifica secoes
-        sections = re.split(r'\n=== Pagina \d+ ===\n', text)
+        sections = PAGE_MARKER_PATTERN.split(text)
         processed_chunks = []
         
         for section in sections:
@@ -201,17 +511,14 @@ def create_text_chunks(text: str, chunk_size: int = 1000, overlap: int = 150) ->
                 
             section = section.strip()
             section_start = 0
+            separator_positions = find_separator_positions(section)
             
             while section_start < len(section) and len(processed_chunks) < max_chunks:
                 end = min(section_start + chunk_size, len(section))
                 
                 # Busca quebra natural
                 if end < len(section):
-                    for separator in ["\n\n", "\n", ". ", "! ", "? ", ": ", "; ", ", "]:
-                        sep_pos = section.rfind(separator, section_start + chunk_size//2, end)
-                        if sep_pos > section_start + chunk_size//3:
-                            end = sep_pos + len(separator)
-                            break
+                    end = find_natural_break(separator_positions, section_start + chunk_size//2, end)
                 
                 chunk_text = section[section_start:end].strip()
                 
@@ -231,32 +538,38 @@ def create_text_chunks(text: str, chunk_size: int = 1000, overlap: int = 150) ->
         if len(processed_chunks) < 5:
             logger.warning("Poucos chunks gerados, usando fallback")
             
-            words = text.split()
+            # Le apenas as 5000 primeiras palavras, sem dividir o texto inteiro
+            words = [match.group() for match in itertools.islice(WORD_PATTERN.finditer(text), FALLBACK_MAX_WORDS)]
             current_chunk = []
+            # Tamanho de ' '.join(current_chunk), atualizado a cada palavra (sem refazer o join)
+            current_length = -1
             
-            for word in words[:5000]:
+            for word in words:
                 current_chunk.append(word)
+                current_length += len(word) + 1
                 
-                if len(' '.join(current_chunk)) > 900:
+                if current_length > 900:
                     chunk_text = ' '.join(current_chunk)
                     if len(chunk_text) > 100:
                         processed_chunks.append(chunk_text)
                     current_chunk = current_chunk[-15:]
+                    current_length = sum(len(kept) for kept in current_chunk) + len(current_chunk) - 1
                     
                 if len(processed_chunks) >= 120:
                     break
             
             # Adiciona ultimo chunk
-            if current_chunk and len(' '.join(current_chunk)) > 100:
+            if current_chunk and current_length > 100:
                 processed_chunks.append(' '.join(current_chunk))
         
         logger.info(f"Criados {len(processed_chunks)} chunks otimizados")
         
         # Log de estatisticas
         if processed_chunks:
-            avg_length = sum(len(chunk) for chunk in processed_chunks) / len(processed_chunks)
-            min_length = min(len(chunk) for chunk in processed_chunks)
-            max_length = max(len(chunk) for chunk in processed_chunks)
+            chunk_lengths = [len(chunk) for chunk in processed_chunks]
+            avg_length = sum(chunk_lengths) / len(chunk_lengths)
+            min_length = min(chunk_lengths)
+            max_length = max(chunk_lengths)
             logger.info(f"Chunks - Media: {avg_length:.0f}, Min: {min_length}, Max: {max_length}")
         
         return processed_chunks
@@ -289,79 +602,208 @@ def create_text_chunks(text: str, chunk_size: int = 1000, overlap: int = 150) ->
         logger.info(f"Fallback de emergencia: {len(emergency_chunks)} chunks")
         return emergency_chunks
 
+def find_processed_file(user_email: str, content_hash: str) -> Optional[dict]:
+    """Procura arquivo ja processado com o mesmo conteudo e chunks ainda armazenados (id e dados)"""
+    with db_lock:
+        row = get_db_connection().execute(
+            "SELECT files.* FROM files "
+            "JOIN text_chunks ON text_chunks.storage_key = files.user_email || '_' || files.file_id "
+            "WHERE files.user_email = ? AND files.content_hash = ? AND text_chunks.created_at >= ? LIMIT 1",
+            (user_email, content_hash, text_chunks_cutoff())
+        ).fetchone()
+    if row is None:
+        return None
+    
+    file_data = row_to_file_data(row)
+    file_data['file_id'] = row['file_id']
+    return file_data
+
+def find_shared_processing(content_hash: str, original_name: str) -> Optional[dict]:
+    """Procura o mesmo PDF (conteudo e nome) ja processado por qualquer usuario, com os chunks armazenados"""
+    # O nome tambem precisa ser igual: o resumo da IA pode cita-lo
+    with db_lock:
+        row = get_db_connection().execute(
+            "SELECT files.*, text_chunks.chunks FROM files "
+            "JOIN text_chunks ON text_chunks.storage_key = files.user_email || '_' || files.file_id "
+            "WHERE files.content_hash = ? AND files.original_name = ? AND text_chunks.created_at >= ? LIMIT 1",
+            (content_hash, original_name, text_chunks_cutoff())
+        ).fetchone()
+    if row is None:
+        return None
+    
+    file_data = row_to_file_data(row)
+    file_data['chunks'] = orjson.loads(row['chunks'])
+    return file_data
+
+class PdfProcessingError(Exception):
+    """Erro de PDF invalido que volta do processo auxiliar (HTTPException nao e serializavel)"""
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def extract_text_from_bytes(pdf_bytes: bytes) -> tuple:
+    """Abre o PDF e extrai o texto (executado no pool de processos)"""
+    try:
+        with open_pdf_document(pdf_bytes) as document:
+            return extract_text_from_pdf(document)
+    except HTTPException as e:
+        raise PdfProcessingError(e.status_code, e.detail)
+
+@lru_cache(maxsize=1)
+def get_pdf_process_pool() -> ProcessPoolExecutor:
+    """Pool de processos para extracao e chunking (CPU), criado no primeiro upload"""
+    # Cada worker web tem seu pool: por padrao os nucleos sao divididos entre os workers
+    web_workers = max(int(os.getenv("WEB_CONCURRENCY", 1)), 1)
+    max_workers = int(os.getenv("PDF_PROCESS_WORKERS", max((os.cpu_count() or 1) // web_workers, 1)))
+    logger.info(f"Pool de processos para PDFs: {max_workers} processos")
+    # spawn: os processos filhos nao herdam threads do servidor; importar as rotas nao abre
+    # o SQLite (a migracao roda no startup do app, em main.py)
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+def reset_pdf_process_pool(broken_pool: ProcessPoolExecutor):
+    """Descarta o pool quebrado (um processo filho morreu); o proximo uso cria outro"""
+    # Uploads simultaneos recebem o mesmo erro: so o primeiro descarta, sem derrubar o pool novo
+    if get_pdf_process_pool() is broken_pool:
+        get_pdf_process_pool.cache_clear()
+        broken_pool.shutdown(wait=False, cancel_futures=True)
+        logger.warning(f"Pool de processos para PDFs quebrado, sera recriado")
+
+def shutdown_pdf_process_pool():
+    """Encerra o pool de processos, se chegou a ser criado (shutdown do app)"""
+    if get_pdf_process_pool.cache_info().currsize:
+        get_pdf_process_pool().shutdown(cancel_futures=True)
+        get_pdf_process_pool.cache_clear()
+
+async def run_in_pdf_pool(func, *args):
+    """Executa no pool de processos, tentando de novo uma vez em um pool novo se um processo morreu"""
+    loop = asyncio.get_running_loop()
+    for _ in range(2):
+        process_pool = get_pdf_process_pool()
+        try:
+            return await loop.run_in_executor(process_pool, func, *args)
+        except BrokenProcessPool:
+            reset_pdf_process_pool(process_pool)
+    # Derrubou o processo duas vezes: o problema e este PDF, os proximos uploads usam um pool novo
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Nao foi possivel processar este PDF"
+    )
+
+async def process_pdf(pdf_bytes: bytes, filename: str) -> tuple:
+    """Extrai texto e gera resumo e chunks em paralelo, fora do event loop"""
+    logger.info(f"Iniciando processamento do PDF...")
+    try:
+        text_content, pages_processed = await run_in_pdf_pool(extract_text_from_bytes, pdf_bytes)
+    except PdfProcessingError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    
+    # Resumo (rede) e chunks (CPU, em outro processo) nao dependem um do outro
+    logger.info(f"Gerando resumo e chunks...")
+    summary, chunks = await asyncio.gather(
+        generate_summary(text_content, filename),
+        run_in_pdf_pool(create_text_chunks, text_content)
+    )
+    
+    if not chunks:
+        raise ValueError("Nenhum chunk criado - arquivo pode estar vazio ou corrompido")
+    
+    return text_content, pages_processed, summary, chunks
+
 @router.post("/", status_code=status.HTTP_201_CREATED)
-async def upload_file(
-    file: UploadFile = File(...),
-    user_email: Optional[str] = Form(default=DEFAULT_USER_EMAIL)
-):
+async def upload_file(request: Request):
     """Upload e processamento de PDF melhorado"""
+    # Le o multipart direto do corpo da requisicao (sem o arquivo temporario do UploadFile)
+    # Rejeita pelo Content-Length antes de ler o corpo
+    content_length = request.headers.get('content-length')
+    if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BODY_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Arquivo muito grande. Maximo: {MAX_FILE_SIZE//(1024*1024)}MB"
+        )
+    
+    pdf_target = PdfUploadTarget()
+    email_target = ValueTarget()
+    
+    try:
+        parser = StreamingFormDataParser(headers=request.headers)
+        parser.register('file', pdf_target)
+        parser.register('user_email', email_target)
+        
+        async for chunk in request.stream():
+            parser.data_received(chunk)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Erro ao ler upload: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Requisicao de upload invalida"
+        )
+    
     # Validacoes
-    if not file.filename.lower().endswith('.pdf'):
+    filename = pdf_target.multipart_filename
+    if not filename:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Apenas arquivos PDF sao aceitos"
+            detail="Arquivo PDF obrigatorio"
         )
 
-    current_user_email = user_email or DEFAULT_USER_EMAIL
-    
-    file_path = None
+    current_user_email = email_target.value.decode('utf-8') or DEFAULT_USER_EMAIL
     
     try:
         # ID unico
         file_id = f"{datetime.now().strftime('%Y%m%d')}_{uuid.uuid4().hex[:8]}"
-        file_path = os.path.join(UPLOAD_DIR, f"{file_id}_{file.filename}")
         
-        # Salva arquivo
-        file_size = 0
-        try:
-            with open(file_path, "wb") as buffer:
-                while chunk := await file.read(8192):
-                    file_size += len(chunk)
-                    if file_size > MAX_FILE_SIZE:
-                        try:
-                            os.remove(file_path)
-                        except:
-                            pass
-                        raise HTTPException(
-                            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                            detail=f"Arquivo muito grande. Maximo: {MAX_FILE_SIZE//(1024*1024)}MB"
-                        )
-                    buffer.write(chunk)
-                    
-            logger.info(f"Arquivo salvo: {file_path} ({file_size:,} bytes) - Usuario: {current_user_email}")
+        # Arquivo recebido em memoria (processamento temporario, sem gravar em disco)
+        pdf_bytes = pdf_target.data
+        file_size = len(pdf_bytes)
+        content_hash = pdf_target.hasher.hexdigest()
+        logger.info(f"Arquivo recebido: {filename} ({file_size:,} bytes) - Usuario: {current_user_email}")
+        
+        # Reaproveita o processamento se o mesmo PDF ja foi enviado
+        # (consulta unica em outra thread: o db_lock pode estar ocupado por um commit)
+        cached_data = await asyncio.to_thread(find_processed_file, current_user_email, content_hash)
+        if cached_data:
+            cached_file_id = cached_data['file_id']
+            logger.info(f"Arquivo identico ja processado: {cached_file_id} - Usuario: {current_user_email}")
             
-            if not os.path.exists(file_path):
-                raise FileNotFoundError(f"Arquivo nao foi criado: {file_path}")
-                
-        except Exception as save_error:
-            logger.error(f"Erro ao salvar arquivo: {save_error}")
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-            except:
-                pass
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Erro ao salvar arquivo: {str(save_error)}"
-            )
-        
-        # Processa PDF
-        logger.info(f"Iniciando processamento do PDF...")
-        text_content = extract_text_from_pdf(file_path)
-        
-        logger.info(f"Gerando resumo...")
-        summary = generate_summary(text_content, file.filename)
-        
-        logger.info(f"Criando chunks...")
-        chunks = create_text_chunks(text_content)
+            return {
+                "file_id": cached_file_id,
+                "original_name": cached_data["original_name"],
+                "summary": cached_data["summary"],
+                "size": cached_data["file_size"],
+                "chunks_created": cached_data.get("chunks_count", 0),
+                "upload_date": cached_data["upload_date"],
+                "status": "success",
+                "message": f"Arquivo '{filename}' ja processado anteriormente!",
+                "file_removed": True,
+                "user_email": current_user_email,
+                "cached": True,
+                "processing_stats": {
+                    "pages_processed": cached_data.get("processing_stats", {}).get("pages_processed", 0),
+                    "text_length": cached_data.get("text_length", 0),
+                    "avg_chunk_size": cached_data.get("processing_stats", {}).get("avg_chunk_size", 0)
+                }
+            }
         
-        if not chunks:
-            raise ValueError("Nenhum chunk criado - arquivo pode estar vazio ou corrompido")
+        # O mesmo PDF enviado por outro usuario reaproveita resumo e chunks (sem extracao nem IA)
+        shared_data = await asyncio.to_thread(find_shared_processing, content_hash, filename)
+        if shared_data:
+            logger.info(f"Reaproveitando processamento de arquivo identico - Usuario: {current_user_email}")
+            summary = shared_data['summary']
+            chunks = shared_data['chunks']
+            text_length = shared_data['text_length']
+            pages_processed = shared_data.get('processing_stats', {}).get('pages_processed', 0)
+        else:
+            # Processa PDF fora do event loop
+            text_content, pages_processed, summary, chunks = await process_pdf(pdf_bytes, filename)
+            text_length = len(text_content)
         
         # Salva chunks no chat.py
         try:
             from routes.chat import save_text_chunks
-            save_success = save_text_chunks(file_id, chunks, current_user_email)
+            save_success = await save_text_chunks(file_id, chunks, current_user_email)
             if save_success:
                 logger.info(f"Chunks salvos no sistema de chat para usuario: {current_user_email}")
             else:
@@ -369,68 +811,54 @@ async def upload_file(
         except Exception as e:
             logger.error(f"Erro ao salvar chunks: {e}")
         
-        # Remove arquivo fisico apos processamento
-        try:
-            os.remove(file_path)
-            logger.info(f"Arquivo fisico removido: {file_path}")
-            file_removed = True
-        except Exception as e:
-            logger.warning(f"Nao foi possivel remover arquivo: {e}")
-            file_removed = False
-        
-        # Salva dados do arquivo
-        if current_user_email not in user_files_data:
-            user_files_data[current_user_email] = {}
+        # Estatisticas calculadas uma vez, para os dados salvos e para a resposta
+        chunk_lengths = [len(chunk) for chunk in chunks]
+        avg_chunk_size = sum(chunk_lengths) // len(chunk_lengths) if chunk_lengths else 0
+        # Mesma data no registro salvo e na resposta
+        upload_date = datetime.now().isoformat()
         
-        user_files_data[current_user_email][file_id] = {
-            'original_name': file.filename,
-            'file_path': file_path if not file_removed else None,
+        # Salva dados do arquivo (escrita no SQLite fora do event loop)
+        await asyncio.to_thread(save_file_data, current_user_email, file_id, {
+            'original_name': filename,
+            'file_path': None,
             'summary': summary,
-            'upload_date': datetime.now().isoformat(),
+            'upload_date': upload_date,
             'file_size': file_size,
+            'content_hash': content_hash,
             'chunks_count': len(chunks),
-            'text_length': len(text_content),
-            'file_removed': file_removed,
+            'text_length': text_length,
+            'file_removed': True,
             'processing_stats': {
-                'pages_processed': text_content.count('=== Pagina'),
-                'avg_chunk_size': sum(len(chunk) for chunk in chunks) // len(chunks) if chunks else 0,
-                'min_chunk_size': min(len(chunk) for chunk in chunks) if chunks else 0,
-                'max_chunk_size': max(len(chunk) for chunk in chunks) if chunks else 0
+                'pages_processed': pages_processed,
+                'avg_chunk_size': avg_chunk_size,
+                'min_chunk_size': min(chunk_lengths, default=0),
+                'max_chunk_size': max(chunk_lengths, default=0)
             }
-        }
-        
-        save_user_files_data()
+        })
         
-        logger.info(f"Processamento concluido: {file.filename} para usuario: {current_user_email}")
+        logger.info(f"Processamento concluido: {filename} para usuario: {current_user_email}")
         
         return {
             "file_id": file_id,
-            "original_name": file.filename,
+            "original_name": filename,
             "summary": summary,
             "size": file_size,
             "chunks_created": len(chunks),
-            "upload_date": datetime.now().isoformat(),
+            "upload_date": upload_date,
             "status": "success",
-            "message": f"Arquivo '{file.filename}' processado com sucesso!",
-            "file_removed": file_removed,
+            "message": f"Arquivo '{filename}' processado com sucesso!",
+            "file_removed": True,
             "user_email": current_user_email,
             "processing_stats": {
-                "pages_processed": text_content.count('=== Pagina'),
-                "text_length": len(text_content),
-                "avg_chunk_size": sum(len(chunk) for chunk in chunks) // len(chunks) if chunks else 0
+                "pages_processed": pages_processed,
+                "text_length": text_length,
+                "avg_chunk_size": avg_chunk_size
             }
         }
         
     except HTTPException:
         raise
     except Exception as e:
-        # Remove arquivo em caso de erro
-        if file_path and os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except:
-                pass
-            
         logger.error(f"Erro no processamento: {str(e)}", exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -443,11 +871,9 @@ async def get_user_files(user_email: Optional[str] = DEFAULT_USER_EMAIL):
     
     current_user_email = user_email or DEFAULT_USER_EMAIL
     
-    if current_user_email not in user_files_data:
-        return {"files": [], "user_email": current_user_email}
-    
     files = []
-    for file_id, file_data in user_files_data[current_user_email].items():
+    user_files_data = await asyncio.to_thread(get_user_files_data, current_user_email)
+    for file_id, file_data in user_files_data.items():
         files.append({
             "file_id": file_id,
             "original_name": file_data["original_name"],
@@ -467,15 +893,15 @@ async def delete_file(file_id: str, user_email: Optional[str] = DEFAULT_USER_EMA
     
     current_user_email = user_email or DEFAULT_USER_EMAIL
     
-    if current_user_email not in user_files_data or file_id not in user_files_data[current_user_email]:
+    file_data = await asyncio.to_thread(get_file_data, current_user_email, file_id)
+    if file_data is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Arquivo nao encontrado para este usuario"
         )
     
     try:
-        file_data = user_files_data[current_user_email][file_id]
-        
+
         # Remove arquivo fisico se existir
         if file_data.get("file_path") and os.path.exists(file_data["file_path"]):
             os.remove(file_data["file_path"])
@@ -483,17 +909,14 @@ async def delete_file(file_id: str, user_email: Optional[str] = DEFAULT_USER_EMA
         
         # Remove chunks do sistema de chat
         try:
-            from routes.chat import text_storage
-            storage_key = f"{current_user_email}_{file_id}"
-            if storage_key in text_storage:
-                del text_storage[storage_key]
+            from routes.chat import delete_text_chunks
+            if await delete_text_chunks(f"{current_user_email}_{file_id}"):
                 logger.info(f"Chunks removidos do chat")
         except Exception as e:
             logger.warning(f"Erro ao remover chunks do chat: {e}")
         
         # Remove dados do arquivo
-        del user_files_data[current_user_email][file_id]
-        save_user_files_data()
+        await asyncio.to_thread(delete_file_data, current_user_email, file_id)
         
         logger.info(f"Arquivo {file_id} removido completamente para usuario: {current_user_email}")
         
@@ -515,15 +938,10 @@ async def delete_file(file_id: str, user_email: Optional[str] = DEFAULT_USER_EMA
 async def upload_status():
     """Status dos servicos"""
     
-    groq_status = groq_client is not None
+    groq_status = get_groq_client() is not None
     
     # Estatisticas dos arquivos
-    total_files = 0
-    total_chunks = 0
-    for user_data in user_files_data.values():
-        total_files += len(user_data)
-        for file_data in user_data.values():
-            total_chunks += file_data.get("chunks_count", 0)
+    total_files, total_chunks, total_users = await asyncio.to_thread(get_files_stats)
     
     response = {
         "status": "ok" if groq_status else "partial",
@@ -541,7 +959,7 @@ async def upload_status():
             "upload_directory": UPLOAD_DIR,
             "total_files_processed": total_files,
             "total_chunks_created": total_chunks,
-            "total_users": len(user_files_data),
+            "total_users": total_users,
             "improvements": [
                 "limpeza_texto_melhorada",
                 "deteccao_tipo_documento", 